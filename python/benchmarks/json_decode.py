@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Quip
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compares decoding large API responses the way the client used to (decode
+the bytes to a string, then `json.loads`) with `quip.loads_json`, which
+uses `orjson` when it is installed. Without `orjson` both do the same work,
+so only the `orjson` numbers are expected to differ.
+
+Two response shapes are measured: `get_threads` batches, which are mostly
+long document HTML strings, and metadata-heavy responses made of many small
+objects, such as message pages or thread listings.
+
+    python benchmarks/json_decode.py --threads 100 --html_kb 200
+"""
+
+import argparse
+import json
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quip
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON decoding benchmark")
+    parser.add_argument("--threads", type=int, default=100,
+        help="Number of threads in the get_threads response")
+    parser.add_argument("--html_kb", type=int, default=200,
+        help="Size of each thread's document HTML, in kilobytes")
+    parser.add_argument("--messages", type=int, default=100000,
+        help="Number of messages in the metadata-heavy response")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("orjson %s" % ("installed" if quip.orjson else "not installed"))
+    paragraph = u"<p id='ABCabc12345' class='line'>Quip \u2014 %d</p>"
+    html = u"".join(paragraph % i for i in range(args.html_kb * 1024 // 48))
+    _compare("get_threads", json.dumps(dict(("thread%d" % i, {
+        "thread": {"id": "thread%d" % i, "title": "Document %d" % i,
+                   "updated_usec": 1400000000000000 + i},
+        "html": html,
+    }) for i in range(args.threads))).encode("utf-8"), args.repeat)
+    _compare("messages", json.dumps([{
+        "id": "message%d" % i,
+        "author_id": "user%d" % (i % 50),
+        "created_usec": 1400000000000000 + i,
+        "text": "Message number %d" % i,
+        "parts": [["system", "Message number %d" % i]],
+    } for i in range(args.messages)]).encode("utf-8"), args.repeat)
+
+
+def _compare(name, response, repeat):
+    print("%s response: %.1f MB" % (name, len(response) / 1e6))
+    for decoder, decode in [
+            ("str + json.loads", lambda: json.loads(response.decode())),
+            ("quip.loads_json", lambda: quip.loads_json(response))]:
+        seconds = min(timeit.repeat(decode, number=1, repeat=repeat))
+        print("  %-18s %7.1f ms  %6.0f MB/s" % (
+            decoder, seconds * 1000, len(response) / 1e6 / seconds))
+
+
+if __name__ == "__main__":
+    main()
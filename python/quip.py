@@ -29,39 +29,72 @@ to append items (in Markdown) to the first bulleted or checklist in a
 given document, which is useful for automating a task list.
 """
 
+import array
+import collections
+import copy
 import datetime
 import json
 import logging
+import random
+import re
+import socket
 import ssl
 import sys
+import threading
 import time
 import xml.etree.cElementTree
+import xml.sax.saxutils
+import zlib
 
 PY3 = sys.version_info > (3,)
 
 if PY3:
-    import urllib.request
+    import http.client
+    import io
+    import queue
     import urllib.parse
     import urllib.error
 
-    Request = urllib.request.Request
+    HTTPConnection = http.client.HTTPConnection
+    HTTPSConnection = http.client.HTTPSConnection
+    HTTPException = http.client.HTTPException
+    BytesIO = io.BytesIO
     urlencode = urllib.parse.urlencode
-    urlopen = urllib.request.urlopen
+    urljoin = urllib.parse.urljoin
+    urlsplit = urllib.parse.urlsplit
     HTTPError = urllib.error.HTTPError
 
     iteritems = dict.items
 
 else:
+    import httplib
+    import Queue as queue
+    import StringIO
     import urllib
     import urllib2
+    import urlparse
 
-    Request = urllib2.Request
+    HTTPConnection = httplib.HTTPConnection
+    HTTPSConnection = httplib.HTTPSConnection
+    HTTPException = httplib.HTTPException
+    BytesIO = StringIO.StringIO
     urlencode = urllib.urlencode
-    urlopen = urllib2.urlopen
+    urljoin = urlparse.urljoin
+    urlsplit = urlparse.urlsplit
     HTTPError = urllib2.HTTPError
 
     iteritems = dict.iteritems
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 try:
     reload(sys)
@@ -103,8 +136,1292 @@ class QuipError(Exception):
         self.http_error = http_error
 
 
+class ConnectionPool(object):
+    """A thread-safe pool of persistent HTTP(S) connections.
+
+    Connections are kept alive between requests and reused, so consecutive
+    API calls to the same host skip the TCP and TLS handshakes. At most
+    `max_connections_per_host` connections are open to a host at a time;
+    further requests block until a connection is returned to the pool.
+    Connections that have sat idle for longer than `idle_timeout` seconds
+    are closed instead of being reused. If a reused connection turns out to
+    have been closed by the server, GET and HEAD requests are sent again on
+    a fresh one; other requests raise, since they may have been applied.
+
+    Every `QuipClient` creates its own pool by default. To share one across
+    clients, pass it explicitly:
+
+        pool = quip.ConnectionPool(max_connections_per_host=20)
+        client = quip.QuipClient(access_token=..., connection_pool=pool)
+    """
+    _REDIRECT_CODES = (301, 302, 303, 307, 308)
+    _IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+    def __init__(self, max_connections_per_host=10, idle_timeout=60,
+                 ssl_context=None, max_redirects=5):
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self.max_redirects = max_redirects
+        self._condition = threading.Condition()
+        # (scheme, host, port) -> [(connection, time returned to the pool)]
+        self._idle = {}
+        # (scheme, host, port) -> number of idle and checked out connections
+        self._open = {}
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Sends a request and returns a `PooledResponse`.
+
+        Redirects are followed. Like `urlopen`, raises `HTTPError` if the
+        final response does not have a 2xx status.
+        """
+        headers = dict(headers or {})
+        for _ in range(self.max_redirects + 1):
+            response = self._request_once(method, url, body, headers, timeout)
+            location = response.getheader("Location")
+            if response.status not in self._REDIRECT_CODES or not location:
+                break
+            response.read()
+            location = urljoin(url, location)
+            if urlsplit(location).netloc != urlsplit(url).netloc:
+                headers.pop("Authorization", None)
+            if response.status == 303 or (
+                    response.status in (301, 302) and method == "POST"):
+                method, body = "GET", None
+                headers.pop("Content-Type", None)
+                headers.pop("Content-Length", None)
+            url = location
+        if not 200 <= response.status < 300:
+            # Error bodies are small; read them now so the connection can go
+            # back to the pool instead of waiting for the error to be freed.
+            raise HTTPError(url, response.status, response.reason,
+                            response.msg, BytesIO(_read_decoded(response)))
+        return response
+
+    def close(self):
+        """Closes all idle connections in the pool."""
+        with self._condition:
+            for key, idle in iteritems(self._idle):
+                for connection, _ in idle:
+                    connection.close()
+                self._open[key] -= len(idle)
+                del idle[:]
+            self._condition.notify_all()
+
+    def _request_once(self, method, url, body, headers, timeout):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        connection, reused = self._checkout(key, timeout)
+        try:
+            try:
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+            except socket.timeout:
+                raise
+            except (HTTPException, socket.error):
+                # The server may have closed the kept-alive connection while
+                # it sat in the pool; try once more on a fresh connection.
+                # Only reads are safe to repeat, since the server may already
+                # have applied a write before the connection dropped.
+                if not reused or method not in self._IDEMPOTENT_METHODS:
+                    raise
+                connection.close()
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+        except Exception:
+            self._release(key, connection, reusable=False)
+            raise
+        return PooledResponse(self, key, connection, response, url)
+
+    def _checkout(self, key, timeout):
+        with self._condition:
+            while True:
+                self._evict_idle()
+                idle = self._idle.get(key)
+                if idle:
+                    connection, _ = idle.pop()
+                    connection.timeout = timeout
+                    if connection.sock:
+                        connection.sock.settimeout(timeout)
+                    return connection, True
+                if self._open.get(key, 0) < self.max_connections_per_host:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                self._condition.wait()
+        try:
+            return self._new_connection(key, timeout), False
+        except Exception:
+            self._release(key, None, reusable=False)
+            raise
+
+    def _new_connection(self, key, timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            context = self.ssl_context
+            if context is None and hasattr(ssl, "create_default_context"):
+                context = ssl.create_default_context()
+            if context is None:
+                return HTTPSConnection(host, port, timeout=timeout)
+            return HTTPSConnection(host, port, timeout=timeout,
+                                   context=context)
+        return HTTPConnection(host, port, timeout=timeout)
+
+    def _release(self, key, connection, reusable):
+        with self._condition:
+            if reusable:
+                self._idle.setdefault(key, []).append((connection, time.time()))
+            else:
+                if connection:
+                    connection.close()
+                self._open[key] -= 1
+            self._condition.notify()
+
+    def _evict_idle(self):
+        # Idle lists are ordered by return time, so stale connections are
+        # always at the front.
+        now = time.time()
+        for key, idle in iteritems(self._idle):
+            while idle and now - idle[0][1] > self.idle_timeout:
+                connection, _ = idle.pop(0)
+                connection.close()
+                self._open[key] -= 1
+                self._condition.notify()
+
+
+class RateLimiter(object):
+    """Paces requests to stay under the Quip API rate limits, and decides
+    when and how long to wait before retrying a failed request.
+
+    Every API response carries X-Ratelimit-Remaining and X-Ratelimit-Reset
+    headers (and X-Company-Ratelimit-* ones for company-wide limits). The
+    limiter is a token bucket that is resynchronized with the most
+    restrictive of these on every response: requests may burst up to `burst`
+    at a time, and the rest of the remaining budget is spread evenly until
+    the limit resets. Until the first response arrives, requests are not
+    paced.
+
+    GET requests are retried on network errors and on the statuses in
+    `RETRY_STATUSES`. Other requests are only retried on the statuses in
+    `WRITE_RETRY_STATUSES`, which mean the server turned the request away
+    without applying it. After a 502 or 504, a write may already have been
+    applied, so it is not sent again. Retries happen up to `max_retries`
+    times with jittered exponential backoff starting at `backoff_base`
+    seconds, or after the server's Retry-After if it is longer.
+
+    If `on_wait` is given, it is called as `on_wait(method, url, seconds)`
+    after every request with the total time spent waiting on the limiter and
+    backoff. A limiter can be shared by clients using the same access token.
+    """
+    RETRY_STATUSES = (429, 502, 503, 504)
+    WRITE_RETRY_STATUSES = (429, 503)
+
+    def __init__(self, burst=10, max_retries=5, backoff_base=1,
+                 max_backoff=60, on_wait=None):
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.on_wait = on_wait
+        self._lock = threading.Lock()
+        self._rate = None  # Tokens per second, or None before any response
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._reset = None
+        self._limit = None
+
+    def reserve(self):
+        """Takes a token and returns how many seconds the caller must wait
+        before sending its request."""
+        with self._lock:
+            now = time.time()
+            if self._reset is not None and now >= self._reset:
+                # A new window has started; assume its full budget until the
+                # next response says otherwise.
+                self._reset = None
+                self._tokens = float(self.burst)
+                self._rate = self._limit / 60.0 if self._limit else None
+            if self._rate is None:
+                return 0.0
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            if self._rate > 0:
+                return -self._tokens / self._rate
+            return max(self._reset - now, 0.0) if self._reset else 0.0
+
+    def update(self, headers):
+        """Resynchronizes the bucket with a response's rate limit headers."""
+        now = time.time()
+        limits = []
+        for prefix in ("X-Ratelimit-", "X-Company-Ratelimit-"):
+            try:
+                remaining = int(headers.get(prefix + "Remaining"))
+                reset = float(headers.get(prefix + "Reset"))
+                limit = int(headers.get(prefix + "Limit") or 0)
+            except (TypeError, ValueError):
+                continue
+            if reset < 1e9:
+                # Seconds until the reset rather than a timestamp
+                reset += now
+            window = max(reset - now, 1.0)
+            limits.append((remaining / window, remaining, reset, limit))
+        if not limits:
+            return
+        _, remaining, reset, limit = min(limits)
+        with self._lock:
+            self._tokens = max(0.0, min(self._tokens, self.burst, remaining))
+            self._rate = (remaining - self._tokens) / max(reset - now, 1.0)
+            self._updated = now
+            self._reset = reset
+            self._limit = limit or self._limit
+
+    def retry_delay(self, attempt, status=None, headers=None, method="GET"):
+        """Returns how many seconds to wait before retry number `attempt`
+        (counting from 0) of a `method` request, or None if the request
+        should not be retried."""
+        if attempt >= self.max_retries:
+            return None
+        statuses = self.RETRY_STATUSES if method == "GET" else \
+            self.WRITE_RETRY_STATUSES
+        if status is not None and status not in statuses:
+            return None
+        delay = min(self.max_backoff, self.backoff_base * 2 ** attempt)
+        delay = random.uniform(delay / 2.0, delay)
+        try:
+            delay = max(delay, float(headers.get("Retry-After")))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return delay
+
+
+class ResponseCache(object):
+    """A bounded in-memory cache of users, folders and threads.
+
+    Pass one to `QuipClient` to have `get_user`, `get_folder` and
+    `get_thread` answer from memory while their entries are fresh:
+
+        client = quip.QuipClient(access_token=..., cache=quip.ResponseCache())
+
+    Entries expire after the number of seconds given for their endpoint in
+    `ttls`, and once `max_entries` entries are cached the least recently
+    used ones are evicted. The client's own writes invalidate the entries
+    they affect, and a cached thread is dropped as soon as any response
+    shows it with a different `updated_usec`. Writes made by other clients
+    are only picked up once entries expire.
+
+    The `hits`, `misses`, `evictions` and `expirations` counters record how
+    well the cache is doing. A cache can be shared by clients that use the
+    same access token.
+    """
+    DEFAULT_TTLS = {
+        "users": 600,
+        "folders": 60,
+        "threads": 60,
+    }
+
+    # Collection endpoints that share a prefix with the cached ones
+    _UNCACHED_PATHS = ("users/current", "users/contacts", "threads/recent",
+                       "threads/search")
+
+    def __init__(self, max_entries=1000, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # path -> (expiry, value)
+
+    def cacheable(self, path):
+        """Returns whether responses for the given API path are cached."""
+        endpoint, _, id = path.partition("/")
+        return bool(id) and self.ttls.get(endpoint) and \
+            path not in self._UNCACHED_PATHS
+
+    def get(self, path):
+        """Returns a copy of the cached response for `path`, or None."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] < time.time():
+                del self._entries[path]
+                self.expirations += 1
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Move the entry to the most recently used end.
+            del self._entries[path]
+            self._entries[path] = entry
+        return copy.deepcopy(entry[1])
+
+    def put(self, path, value):
+        if not self.cacheable(path):
+            return
+        entry = (time.time() + self.ttls[path.partition("/")[0]],
+                 copy.deepcopy(value))
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def observe_thread(self, thread):
+        """Drops the cached copy of the given thread response if it is for a
+        different version of the thread."""
+        path = "threads/" + thread["thread"]["id"]
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[1]["thread"].get("updated_usec") != \
+                    thread["thread"].get("updated_usec"):
+                del self._entries[path]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ThreadStore(object):
+    """A persistent on-disk cache of thread and message responses, stored in
+    the SQLite database at `path`.
+
+    Entries are keyed by thread ID and the thread's `updated_usec`, so an
+    entry is valid for as long as the thread has not changed. Pass a store
+    to `QuipClient` as `thread_store`; `get_thread` and `get_threads` then
+    save their responses in it, and `get_threads_cached` and
+    `get_messages_cached` only go to the network for threads whose
+    `updated_usec` differs from the stored one:
+
+        store = quip.ThreadStore("threads.db", max_bytes=1 << 30)
+        client = quip.QuipClient(access_token=..., thread_store=store)
+        recent = client.get_recent_threads(count=50)
+        threads = client.get_threads_cached(dict(
+            (t["thread"]["id"], t["thread"]["updated_usec"])
+            for t in recent.values()))
+
+    Only the latest version of each thread is kept. Payloads are stored
+    compressed; once they take up more than `max_bytes`, the least recently
+    used entries are deleted. Call `compact` to also return the freed space
+    to the file system.
+    """
+    def __init__(self, path, max_bytes=None):
+        import sqlite3
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                updated_usec INTEGER,
+                payload BLOB,
+                size INTEGER,
+                accessed REAL);
+            CREATE TABLE IF NOT EXISTS messages (
+                thread_id TEXT,
+                query TEXT,
+                updated_usec INTEGER,
+                payload BLOB,
+                size INTEGER,
+                accessed REAL,
+                PRIMARY KEY (thread_id, query));
+        """)
+        self._size = self._total_size()
+
+    def get_thread(self, thread_id, updated_usec):
+        """Returns the stored response for the given version of the thread,
+        or None."""
+        return self._get("threads", "thread_id = ?", (thread_id,),
+                         updated_usec)
+
+    def put_thread(self, thread):
+        """Stores a response returned by `get_thread`."""
+        self._put("threads", ("thread_id",), (thread["thread"]["id"],),
+                  thread["thread"]["updated_usec"], thread)
+
+    def get_messages(self, thread_id, updated_usec, max_created_usec=None,
+                     count=None):
+        """Returns the stored response of `get_messages` with the given
+        arguments for the given version of the thread, or None."""
+        return self._get(
+            "messages", "thread_id = ? AND query = ?",
+            (thread_id, "%s:%s" % (max_created_usec, count)), updated_usec)
+
+    def put_messages(self, thread_id, updated_usec, messages,
+                     max_created_usec=None, count=None):
+        """Stores a response of `get_messages` for the given version of the
+        thread."""
+        self._put("messages", ("thread_id", "query"),
+                  (thread_id, "%s:%s" % (max_created_usec, count)),
+                  updated_usec, messages)
+
+    def compact(self):
+        """Deletes the least recently used entries until the store fits in
+        `max_bytes`, and shrinks the database file."""
+        with self._lock:
+            self._evict()
+            self._db.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get(self, table, where, args, updated_usec):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated_usec, payload FROM %s WHERE %s" % (
+                    table, where), args).fetchone()
+            if not row or row[0] != updated_usec:
+                return None
+            self._db.execute("UPDATE %s SET accessed = ? WHERE %s" % (
+                table, where), (time.time(),) + args)
+            self._db.commit()
+        return loads_json(zlib.decompress(row[1]))
+
+    def _put(self, table, key_columns, key, updated_usec, value):
+        import sqlite3
+        payload = sqlite3.Binary(zlib.compress(json.dumps(value).encode()))
+        columns = key_columns + ("updated_usec", "payload", "size", "accessed")
+        with self._lock:
+            where = " AND ".join("%s = ?" % c for c in key_columns)
+            row = self._db.execute("SELECT size FROM %s WHERE %s" % (
+                table, where), key).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO %s (%s) VALUES (%s)" % (
+                    table, ", ".join(columns), ", ".join("?" * len(columns))),
+                key + (updated_usec, payload, len(payload), time.time()))
+            self._size += len(payload) - (row[0] if row else 0)
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        # Both tables are emptied oldest access first, in batches.
+        while self.max_bytes is not None and self._size > self.max_bytes:
+            rows = self._db.execute("""
+                SELECT 'threads', rowid, size, accessed FROM threads
+                UNION ALL
+                SELECT 'messages', rowid, size, accessed FROM messages
+                ORDER BY accessed LIMIT 100""").fetchall()
+            if not rows:
+                break
+            for table, rowid, size, _ in rows:
+                self._db.execute(
+                    "DELETE FROM %s WHERE rowid = ?" % table, (rowid,))
+                self._size -= size
+                if self._size <= self.max_bytes:
+                    break
+        self._db.commit()
+
+    def _total_size(self):
+        return sum(self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM %s" % table).fetchone()[0]
+            for table in ("threads", "messages"))
+
+
+class UserDirectory(object):
+    """A bounded directory of users, keyed by ID or email address, that looks
+    up the users it does not know yet in batches.
+
+    Get one from `QuipClient.user_directory`. Resolving the authors of a page
+    of messages before rendering it fetches all the unknown ones with one
+    `get_users` request, instead of a `get_user` request each:
+
+        users = client.user_directory()
+        users.warm()
+        authors = users.resolve(m["author_id"] for m in messages)
+        names = [authors[m["author_id"]]["name"] for m in messages]
+
+    `warm` adds the authenticated user's contacts, usually most of the users
+    a client comes across, with a single request. Users that cannot be found
+    are remembered as None. Once `max_entries` keys are known the least
+    recently used ones are evicted. A directory can be shared by threads,
+    and by clients that use the same access token.
+    """
+    def __init__(self, client, max_entries=10000):
+        self.client = client
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # ID or email -> user
+
+    def warm(self):
+        """Adds the authenticated user's contacts to the directory."""
+        self._add(dict((user["id"], user)
+                       for user in self.client.get_contacts()))
+
+    def resolve(self, ids):
+        """Returns a dictionary of the users for the given IDs or email
+        addresses, with None for the ones that do not exist. Only the ones
+        the directory does not know yet are fetched."""
+        ids = list(ids)
+        unknown = self._unknown(ids)
+        if unknown:
+            self._add(self._fetch(unknown), unknown)
+        return self._lookup(ids)
+
+    def get(self, id):
+        """Returns the user with the given ID or email address, or None."""
+        return self.resolve([id])[id]
+
+    def _fetch(self, ids):
+        if len(ids) > 1:
+            try:
+                return self.client.get_users(ids)
+            except (QuipError, HTTPError):
+                # A single bad ID fails the whole batch.
+                pass
+        users = {}
+        for id in ids:
+            try:
+                users[id] = self.client.get_user(id)
+            except (QuipError, HTTPError):
+                pass
+        return users
+
+    def _unknown(self, ids):
+        with self._lock:
+            return list(collections.OrderedDict.fromkeys(
+                id for id in ids if id not in self._entries))
+
+    def _add(self, users, requested=()):
+        with self._lock:
+            for requested_key, user in users.items():
+                for key in set([requested_key, user["id"]]):
+                    self._entries.pop(key, None)
+                    self._entries[key] = user
+            for key in requested:
+                if key not in users:
+                    self._entries.pop(key, None)
+                    self._entries[key] = None
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup(self, ids):
+        with self._lock:
+            users = {}
+            for id in ids:
+                if id in self._entries:
+                    # Move the entry to the most recently used end.
+                    users[id] = self._entries.pop(id)
+                    self._entries[id] = users[id]
+                else:
+                    users[id] = None
+            return users
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _SingleFlight(object):
+    """Coalesces concurrent identical calls: while a call for a key is in
+    flight, other callers with the same key wait for it and receive a copy
+    of its result (or its exception) instead of making the call again."""
+    class _Call(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.waiters = 0
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            # No more waiters can join now. They get their own copy of the
+            # result, so none of them sees changes another caller makes.
+            result = call.result
+            if call.waiters and not call.error:
+                call.result = copy.deepcopy(result)
+            call.event.set()
+        return result
+
+
+class _FolderLevel(object):
+    """The bookkeeping for one level of `QuipClient.walk_folders`.
+
+    Given the paths of the level's folders and their responses, collects the
+    IDs of their threads and of the next level's folders (skipping folders in
+    `seen`, which it updates), and hands out `(path, folder, threads)`
+    records as soon as all of a folder's threads have been added.
+    """
+    def __init__(self, paths, folders, seen):
+        self.thread_ids = []
+        self.next_paths = []
+        self._records = []
+        self._waiting = {}
+        self._refs = {}
+        self._threads = {}
+        for path in paths:
+            folder = folders.get(path[-1])
+            if folder is None:
+                continue
+            ids = [c["thread_id"] for c in folder["children"]
+                   if "thread_id" in c]
+            record = [path, folder, ids, len(set(ids))]
+            self._records.append(record)
+            for id in set(ids):
+                if id not in self._refs:
+                    self._refs[id] = 0
+                    self._waiting[id] = []
+                    self.thread_ids.append(id)
+                self._refs[id] += 1
+                self._waiting[id].append(record)
+            for child in folder["children"]:
+                if "folder_id" in child and child["folder_id"] not in seen:
+                    seen.add(child["folder_id"])
+                    self.next_paths.append(path + (child["folder_id"],))
+
+    def ready(self):
+        """Returns the records of the folders that have no threads."""
+        return [self._finish(r) for r in self._records if r[3] == 0]
+
+    def add_threads(self, threads):
+        """Adds a dictionary of thread responses, and returns the records of
+        the folders it completes."""
+        done = []
+        for id, thread in threads.items():
+            if id not in self._waiting:
+                continue
+            self._threads[id] = thread
+            for record in self._waiting.pop(id):
+                record[3] -= 1
+                if record[3] == 0:
+                    done.append(self._finish(record))
+        return done
+
+    def rest(self):
+        """Returns the records of the folders with threads that could not be
+        fetched, without those threads."""
+        return [self._finish(r) for r in self._records if r[3] > 0]
+
+    def _finish(self, record):
+        path, folder, ids, _ = record
+        record[3] = -1
+        threads = [self._threads[id] for id in ids if id in self._threads]
+        # A thread is released once every folder holding it has been handed
+        # out, so a level's documents are not all kept in memory at once.
+        for id in set(ids):
+            self._refs[id] -= 1
+            if not self._refs[id]:
+                self._threads.pop(id, None)
+        return path, folder, threads
+
+
+class DocumentSnapshot(object):
+    """A parsed Quip document, indexed for repeated lookups.
+
+    Create one with `QuipClient.snapshot`, and pass it as the
+    `document_html` of the client's document helpers (`get_section`,
+    `get_first_list`, `get_named_spreadsheet`, ...) to look sections up
+    without fetching and parsing the document again. The indexes of its
+    elements by ID, by tag and by title are each built on first use.
+    `thread` is the response the document came from, if any.
+    """
+    def __init__(self, tree, thread=None):
+        self.tree = tree
+        self.thread = thread
+        self._ids = None
+        self._tags = None
+        self._titles = None
+        self._spreadsheet_indexes = {}
+
+    def find_by_id(self, section_id):
+        """Returns the element with the given ID, or None."""
+        if self._ids is None:
+            self._ids = self._index("id")
+        return self._ids.get(section_id)
+
+    def find_by_title(self, title):
+        """Returns the first element with the given title, such as a named
+        spreadsheet, or None."""
+        if self._titles is None:
+            self._titles = self._index("title")
+        return self._titles.get(title)
+
+    def find_all(self, tag):
+        """Returns the elements with the given tag, in document order."""
+        if self._tags is None:
+            self._tags = {}
+            if self.tree is not None:
+                for element in self.tree.iter():
+                    self._tags.setdefault(element.tag, []).append(element)
+        return self._tags.get(tag, [])
+
+    def get_spreadsheet_index(self, spreadsheet_tree):
+        """Returns the `SpreadsheetIndex` of one of the document's
+        spreadsheets, which is kept for later lookups."""
+        key = id(spreadsheet_tree)
+        if key not in self._spreadsheet_indexes:
+            self._spreadsheet_indexes[key] = SpreadsheetIndex(spreadsheet_tree)
+        return self._spreadsheet_indexes[key]
+
+    def _reset(self, tree, thread):
+        self.tree = tree
+        self.thread = thread
+        self._ids = None
+        self._tags = None
+        self._titles = None
+        self._spreadsheet_indexes = {}
+
+    def _index(self, attribute):
+        index = {}
+        if self.tree is not None:
+            for element in self.tree.iter():
+                value = element.attrib.get(attribute)
+                if value is not None and element is not self.tree:
+                    index.setdefault(value, element)
+        return index
+
+
+class SpreadsheetIndex(object):
+    """Finds the rows of a spreadsheet `ElementTree` by the values of their
+    cells.
+
+    Rows are indexed by the case-insensitive text of a column, or of a
+    tuple of columns, on the first lookup by it, after which lookups take
+    constant time. Columns are named as in `QuipClient.get_index_of_header`.
+    The header row is not indexed. Change the spreadsheet through
+    `set_cell`, `add_row` and `remove_row` to keep the index up to date.
+
+        index = client.get_spreadsheet_index(spreadsheet)
+        row = index.find("Customer", "Acme")
+        row_id = index.find_id(("Customer", "Region"), ("Acme", "EMEA"))
+    """
+    def __init__(self, spreadsheet_tree):
+        self.spreadsheet = spreadsheet_tree
+        rows = list(spreadsheet_tree.iterfind(".//tr"))
+        self.headers = [(list(x.itertext()) or [None])[0]
+                        for x in rows[0]] if rows else []
+        self.rows = rows[1:]
+        self._indexes = {}
+        self._positions = None
+
+    def find(self, header, value):
+        """Returns the first row whose `header` cell (or cells, for a tuple
+        of headers and values) holds `value`, or None."""
+        rows = self.find_all(header, value)
+        return rows[0] if rows else None
+
+    def find_all(self, header, value):
+        """Returns all of the rows whose `header` cells hold `value`."""
+        columns = self._columns(header)
+        if columns not in self._indexes:
+            index = self._indexes[columns] = {}
+            for row in self.rows:
+                key = self._key(row, columns)
+                if key is not None:
+                    index.setdefault(key, []).append(row)
+        values = value if isinstance(header, (tuple, list)) else (value,)
+        return self._indexes[columns].get(
+            tuple(_normalize_cell_text(v) for v in values), [])
+
+    def find_id(self, header, value):
+        """Like `find`, but returns the ID of the row."""
+        row = self.find(header, value)
+        return row.attrib.get("id") if row is not None else None
+
+    def set_cell(self, row, header, value):
+        """Replaces the text of the given row's `header` cell, as an edit of
+        the cell does."""
+        column = self._column(header)
+        cell = row[column]
+        self._unindex(row, column)
+        for child in list(cell):
+            cell.remove(child)
+        cell.text = u"%s" % value
+        self._reindex(row, column)
+
+    def add_row(self, row):
+        """Adds a row `ElementTree` at the end of the spreadsheet."""
+        self.rows.append(row)
+        if self._positions is not None:
+            self._positions[row] = len(self.rows) - 1
+        self._reindex(row)
+
+    def remove_row(self, row):
+        self._unindex(row)
+        self.rows.remove(row)
+        # The rows after it have moved up.
+        self._positions = None
+
+    def _columns(self, header):
+        headers = header if isinstance(header, (tuple, list)) else (header,)
+        return tuple(self._column(h) for h in headers)
+
+    def _column(self, header):
+        if isinstance(header, int):
+            return header
+        return _index_of_header(self.headers, header)
+
+    def _key(self, row, columns):
+        key = []
+        for column in columns:
+            if len(row) <= column or row[column].tag != "td":
+                return None
+            key.append(_normalize_cell_text(_cell_text(row[column])))
+        return tuple(key)
+
+    def _unindex(self, row, column=None):
+        for columns, index in self._indexes.items():
+            if column is not None and column not in columns:
+                continue
+            rows = index.get(self._key(row, columns))
+            if rows:
+                i = self._bisect(rows, row)
+                if i < len(rows) and rows[i] is row:
+                    del rows[i]
+
+    def _reindex(self, row, column=None):
+        for columns, index in self._indexes.items():
+            if column is not None and column not in columns:
+                continue
+            key = self._key(row, columns)
+            if key is not None:
+                rows = index.setdefault(key, [])
+                # Keep the rows of a key in document order.
+                rows.insert(self._bisect(rows, row), row)
+
+    def _bisect(self, rows, row):
+        """Returns where `row` is, or belongs, in a list of rows in document
+        order."""
+        position = self._position(row)
+        low, high = 0, len(rows)
+        if high and self._position(rows[-1]) < position:
+            return high
+        while low < high:
+            middle = (low + high) // 2
+            if self._position(rows[middle]) < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _position(self, row):
+        if self._positions is None:
+            self._positions = dict(
+                (r, i) for i, r in enumerate(self.rows))
+        return self._positions[row]
+
+
+def _index_of_header(header_items, header, default=0):
+    if header:
+        header = str(header)
+        lower_headers = [str(h).lower() for h in header_items]
+        if header in header_items:
+            return header_items.index(header)
+        elif header.lower() in lower_headers:
+            return lower_headers.index(header.lower())
+        elif header.isdigit():
+            return int(header)
+        elif len(header) == 1:
+            char = ord(header.upper())
+            if ord('A') < char < ord('Z'):
+                return char - ord('A') + 1
+        else:
+            pass
+    return default
+
+
+def _cell_text(cell):
+    return (list(cell.itertext()) or [""])[0].replace(u"\u200b", "")
+
+
+def _cell_full_text(cell):
+    return u"".join(cell.itertext()).replace(u"\u200b", "")
+
+
+def _escape_cell(value):
+    return xml.sax.saxutils.escape(u"%s" % value)
+
+
+def _normalize_cell_text(value):
+    return (u"%s" % value).replace(u"\u200b", "").lower()
+
+
+def _cell_content(cell):
+    """Returns the source of the image in a spreadsheet cell, or its text."""
+    images = list(cell.iter("img"))
+    if images:
+        return images[0].attrib.get("src")
+    return _cell_text(cell)
+
+
+def _cell_color(cell):
+    """Returns the background color of a spreadsheet cell, or None."""
+    style = cell.attrib.get("style")
+    if style and "background-color:#" in style:
+        sharp = style.find("#")
+        return style[sharp + 1:sharp + 7]
+    return None
+
+
+_NUMBER_RE = re.compile(r"^[-+]?(\d+|\d{1,3}(,\d{3})+)?(\.\d+)?$")
+_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%b %d, %Y", "%B %d, %Y")
+_INT_TYPECODE = "q" if PY3 else "l"
+
+
+def _numpy():
+    # NumPy is optional and slow to import, so it is only loaded when needed.
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _column_array(texts, infer_types, numpy):
+    """Returns the values of a spreadsheet column as an array: of ints,
+    floats or dates if `infer_types` and all of its non-empty cells hold
+    one of them, and of text otherwise."""
+    texts = [text.strip() for text in texts]
+    filled = [text for text in texts if text]
+    if infer_types and filled:
+        if all(_NUMBER_RE.match(text) and text not in "+-." for text in filled):
+            numbers = [text.replace(",", "") for text in texts]
+            if (len(filled) == len(texts) and
+                    not any("." in n for n in numbers) and
+                    all(abs(int(n)) < 2 ** 63 for n in numbers)):
+                ints = [int(n) for n in numbers]
+                if numpy:
+                    return numpy.array(ints, dtype=numpy.int64)
+                return array.array(_INT_TYPECODE, ints)
+            floats = [float(n) if n else float("nan") for n in numbers]
+            if numpy:
+                return numpy.array(floats, dtype=numpy.float64)
+            return array.array("d", floats)
+        dates = _parse_dates(texts, filled[0])
+        if dates is not None:
+            if numpy:
+                return numpy.array(
+                    [numpy.datetime64(d) if d else numpy.datetime64("NaT")
+                     for d in dates], dtype="datetime64[D]")
+            return dates
+    if numpy:
+        values = numpy.empty(len(texts), dtype=object)
+        values[:] = texts
+        return values
+    return texts
+
+
+def _parse_dates(texts, sample):
+    """Returns the given texts as dates (None for empty ones) if they all
+    have the date format of `sample`, or else None."""
+    for date_format in _DATE_FORMATS:
+        try:
+            datetime.datetime.strptime(sample, date_format)
+        except ValueError:
+            continue
+        # Columns tend to repeat dates, and strptime is slow.
+        parsed = {u"": None}
+        try:
+            for text in texts:
+                if text not in parsed:
+                    parsed[text] = datetime.datetime.strptime(
+                        text, date_format).date()
+        except ValueError:
+            return None
+        return [parsed[text] for text in texts]
+    return None
+
+
+class _DocumentReader(object):
+    """A file-like view of document HTML wrapped in `<html>` tags, which
+    encodes it a chunk at a time as `iterparse` reads it."""
+    def __init__(self, document_html, chunk_size=64 * 1024):
+        self._chunks = self._iter_chunks(document_html, chunk_size)
+
+    def read(self, size=-1):
+        return next(self._chunks, b"")
+
+    def _iter_chunks(self, document_html, chunk_size):
+        yield b"<html>"
+        for i in range(0, len(document_html), chunk_size):
+            chunk = document_html[i:i + chunk_size]
+            yield chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+        yield b"</html>"
+
+
+class MultipartBody(object):
+    """A multipart/form-data request body that is read from its parts as it
+    is sent, so uploading a large file does not load it into memory.
+
+    `parts` is a list of byte strings and `(file, length)` pairs. The body is
+    file-like: `read` returns the next bytes, and `seek(0)` rewinds it so a
+    request can be sent again. If given, `progress` is called as
+    `progress(bytes_sent, total_bytes)` as the body is read.
+    """
+    def __init__(self, parts, progress=None):
+        self.progress = progress
+        self._parts = []
+        for part in parts:
+            if isinstance(part, tuple):
+                part = (part[0], part[0].tell(), part[1])
+            self._parts.append(part)
+        self.length = sum(
+            len(p) if isinstance(p, bytes) else p[2] for p in self._parts)
+        self.seek(0)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length - self._sent
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                chunk = part[self._offset:self._offset + size]
+            else:
+                chunk = part[0].read(min(size, part[2] - self._offset))
+                if not chunk:
+                    raise IOError("Blob ended %d bytes short of its length"
+                                  % (part[2] - self._offset))
+            chunks.append(chunk)
+            size -= len(chunk)
+            self._offset += len(chunk)
+            if self._offset == (len(part) if isinstance(part, bytes)
+                                else part[2]):
+                self._index += 1
+                self._offset = 0
+        data = b"".join(chunks)
+        self._sent += len(data)
+        if data and self.progress:
+            self.progress(self._sent, self.length)
+        return data
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise IOError("A multipart body can only be rewound to its start")
+        for part in self._parts:
+            if not isinstance(part, bytes):
+                part[0].seek(part[1])
+        self._index = 0
+        self._offset = 0
+        self._sent = 0
+
+    def __len__(self):
+        return self.length
+
+
+class ContentDecoder(object):
+    """Incrementally decompresses a response body according to its
+    Content-Encoding: gzip, deflate, or br if the `brotli` module is
+    installed.
+
+        decoder = ContentDecoder(response.getheader("Content-Encoding"))
+        data = decoder.decode(chunk) + ... + decoder.flush()
+    """
+    # The value of the Accept-Encoding header for the supported encodings
+    ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+    def __init__(self, encoding):
+        self.encoding = (encoding or "identity").strip().lower()
+        self._decompressor = None
+        if self.encoding in ("gzip", "x-gzip"):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == "br" and brotli:
+            self._decompressor = brotli.Decompressor()
+        elif self.encoding not in ("identity", "deflate"):
+            raise IOError("Unsupported Content-Encoding " + self.encoding)
+
+    def decode(self, data):
+        if self.encoding == "identity" or not data:
+            return data
+        if self._decompressor is None:
+            # "deflate" is meant to be zlib-wrapped, but some servers send a
+            # raw deflate stream; tell them apart by the first bytes.
+            header = bytearray(data[:2])
+            wrapped = len(header) == 2 and header[0] & 0x0f == 8 and \
+                (header[0] * 256 + header[1]) % 31 == 0
+            self._decompressor = zlib.decompressobj(
+                zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+        if self.encoding == "br":
+            return self._decompressor.process(data)
+        return self._decompressor.decompress(data)
+
+    def flush(self):
+        if self._decompressor is None or self.encoding == "br":
+            return b""
+        return self._decompressor.flush()
+
+
+def loads_json(data):
+    """Decodes JSON from the given UTF-8 bytes with `orjson` if it is
+    installed, which parses bytes directly and is much faster on large
+    responses, and with the standard `json` module otherwise."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def _read_decoded(response, chunk_size=64 * 1024):
+    """Reads the whole body of the given response, decompressing it as it
+    arrives."""
+    decoder = ContentDecoder(response.getheader("Content-Encoding"))
+    if decoder.encoding == "identity":
+        return response.read()
+    chunks = []
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        chunks.append(decoder.decode(chunk))
+    chunks.append(decoder.flush())
+    return b"".join(chunks)
+
+
+def _content_range_total(content_range):
+    """Returns the complete length from a Content-Range header value such as
+    "bytes 0-99/1234" or "bytes */1234", or None if it is not given."""
+    if content_range and "/" in content_range:
+        total = content_range.rpartition("/")[2]
+        if total.isdigit():
+            return int(total)
+    return None
+
+
+class PooledResponse(object):
+    """A file-like HTTP response that hands its connection back to the
+    `ConnectionPool` once the body has been read or the response is closed.
+
+    Supports the same `read`, `info`, `geturl` and `getcode` methods as the
+    object returned by `urlopen`.
+    """
+    def __init__(self, pool, key, connection, response, url):
+        self.status = self.code = response.status
+        self.reason = response.reason
+        self.msg = self.headers = response.msg
+        self.url = url
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+    def read(self, amt=None):
+        if self._response is None:
+            return b""
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        if amt is None or not data or self._response.isclosed():
+            self._finish()
+        return data
+
+    def readinto(self, b):
+        if self._response is None:
+            return 0
+        if hasattr(self._response, "readinto"):
+            n = self._response.readinto(b)
+        else:
+            data = self._response.read(len(b))
+            n = len(data)
+            b[:n] = data
+        if not n or self._response.isclosed():
+            self._finish()
+        return n
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name, default)
+
+    def info(self):
+        return self.msg
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def close(self):
+        self._finish()
+
+    def _finish(self):
+        if self._response is None:
+            return
+        # A connection can only be reused once its response has been read to
+        # the end and the server has not asked to close it.
+        reusable = self._response.isclosed() and not self._response.will_close
+        if not reusable:
+            self._response.close()
+        self._pool._release(self._key, self._connection, reusable)
+        self._response = None
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
 class QuipClient(object):
     """A Quip API client"""
+    # Write endpoints, and the (cache path prefix, argument) pairs naming the
+    # cached responses each one makes stale
+    _WRITE_INVALIDATIONS = {
+        "users/update": [("users/", "user_id")],
+        "folders/new": [("folders/", "parent_id")],
+        "folders/update": [("folders/", "folder_id")],
+        "folders/add-members": [("folders/", "folder_id")],
+        "folders/remove-members": [("folders/", "folder_id")],
+        "messages/new": [("threads/", "thread_id")],
+        "threads/add-members": [
+            ("threads/", "thread_id"), ("folders/", "member_ids")],
+        "threads/remove-members": [
+            ("threads/", "thread_id"), ("folders/", "member_ids")],
+        "threads/delete": [("threads/", "thread_id")],
+        "threads/new-chat": [("folders/", "member_ids")],
+        "threads/new-document": [("folders/", "member_ids")],
+        "threads/copy-document": [("folders/", "folder_ids")],
+        "threads/edit-document": [("threads/", "thread_id")],
+    }
+
     # Edit operations
     APPEND, \
         PREPEND, \
@@ -121,7 +1438,10 @@ class QuipClient(object):
         BLUE = range(5)
 
     def __init__(self, access_token=None, client_id=None, client_secret=None,
-                 base_url=None, request_timeout=None):
+                 base_url=None, request_timeout=None, connection_pool=None,
+                 rate_limiter=None, batch_size=100, max_workers=8,
+                 coalesce_reads=True, cache=None, thread_store=None,
+                 json_decoder=None):
         """Constructs a Quip API client.
 
         If `access_token` is given, all of the API methods in the client
@@ -130,12 +1450,41 @@ class QuipClient(object):
         Otherwise, only `get_authorization_url` and `get_access_token`
         work, and we assume the client is for a server using the Quip API's
         OAuth endpoint.
+
+        Requests are sent over kept-alive connections from `connection_pool`.
+        If none is given, the client creates its own `ConnectionPool`.
+        Requests are paced, and throttled or failed requests retried, by
+        `rate_limiter`, which likewise defaults to a new `RateLimiter`.
+
+        Bulk getters such as `get_threads` request at most `batch_size` IDs
+        at a time, and fetch up to `max_workers` batches concurrently.
+
+        If `coalesce_reads` is true, a GET request made while an identical
+        one is already in flight on another thread waits for that request
+        and shares its result instead of being sent again.
+
+        If a `ResponseCache` is given as `cache`, users, folders and threads
+        are served from it while fresh. Responses of `get_thread` and
+        `get_threads` are saved in `thread_store`, if given; see
+        `ThreadStore`.
+
+        Response bodies are decoded by calling `json_decoder` with their raw
+        bytes; the default, `loads_json`, uses `orjson` when available.
         """
         self.access_token = access_token
         self.client_id = client_id
         self.client_secret = client_secret
         self.base_url = base_url if base_url else "https://platform.quip.com"
         self.request_timeout = request_timeout if request_timeout else 10
+        self.connection_pool = connection_pool if connection_pool else \
+            ConnectionPool()
+        self.rate_limiter = rate_limiter if rate_limiter else RateLimiter()
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self._in_flight = _SingleFlight() if coalesce_reads else None
+        self.cache = cache
+        self.thread_store = thread_store
+        self.json_decoder = json_decoder if json_decoder else loads_json
 
     def get_authorization_url(self, redirect_uri, state=None):
         """Returns the URL the user should be redirected to to sign in."""
@@ -167,7 +1516,17 @@ class QuipClient(object):
 
     def get_users(self, ids):
         """Returns a dictionary of users for the given IDs."""
-        return self._fetch_json("users/", post_data={"ids": ",".join(ids)})
+        return self._fetch_batched("users/", ids)
+
+    def iter_users(self, ids):
+        """Like `get_users`, but yields a dictionary for each batch of IDs as
+        soon as it arrives."""
+        return self._iter_batched("users/", ids)
+
+    def user_directory(self, **kwargs):
+        """Returns a `UserDirectory` that looks up users in batches and
+        remembers them."""
+        return UserDirectory(self, **kwargs)
 
     def update_user(self, user_id, picture_url=None):
         return self._fetch_json("users/update", post_data={
@@ -185,7 +1544,54 @@ class QuipClient(object):
 
     def get_folders(self, ids):
         """Returns a dictionary of folders for the given IDs."""
-        return self._fetch_json("folders/", post_data={"ids": ",".join(ids)})
+        return self._fetch_batched("folders/", ids)
+
+    def iter_folders(self, ids):
+        """Like `get_folders`, but yields a dictionary for each batch of IDs as
+        soon as it arrives."""
+        return self._iter_batched("folders/", ids)
+
+    def walk_folders(self, root_ids):
+        """Walks the folder trees under the given folders breadth-first,
+        yielding `(path, folder, threads)` for each folder.
+
+        `path` is the tuple of folder IDs from the root to the folder, and
+        `threads` the responses of the threads in the folder, in order. Each
+        level of the trees is fetched with batched `get_folders` and
+        `get_threads` calls on the client's worker pool, and folders are
+        yielded as soon as their threads arrive, parents before children.
+        A folder reachable through several parents is visited once, under
+        the first path found. Folders and threads that cannot be fetched,
+        such as restricted ones, are logged and skipped.
+
+            client = quip.QuipClient(...)
+            user = client.get_authenticated_user()
+            for path, folder, threads in client.walk_folders(
+                    [user["private_folder_id"]]):
+                ...
+        """
+        seen = set()
+        paths = []
+        for id in root_ids:
+            if id not in seen:
+                seen.add(id)
+                paths.append((id,))
+        while paths:
+            folders = {}
+            for batch in self._iter_batched(
+                    "folders/", [p[-1] for p in paths], isolate_errors=True):
+                folders.update(batch)
+            level = _FolderLevel(paths, folders, seen)
+            for record in level.ready():
+                yield record
+            if level.thread_ids:
+                for batch in self._iter_batched(
+                        "threads/", level.thread_ids, isolate_errors=True):
+                    for record in level.add_threads(batch):
+                        yield record
+            for record in level.rest():
+                yield record
+            paths = level.next_paths
 
     def new_folder(self, title, parent_id=None, color=None, member_ids=[]):
         return self._fetch_json("folders/new", post_data={
@@ -233,6 +1639,41 @@ class QuipClient(object):
             "messages/" + thread_id, max_created_usec=max_created_usec,
             count=count)
 
+    def iter_messages(self, thread_id, count=100, max_created_usec=None):
+        """Yields all of the messages of the given thread, newest first.
+
+        Pages of `count` messages (at most 100) are requested with
+        `get_messages`; the next page is downloaded in the background while
+        the caller works through the current one, and no more than that is
+        held in memory.
+        """
+        count = min(count, 100)
+        return self._prefetch_pages(
+            lambda cursor: self.get_messages(
+                thread_id, max_created_usec=cursor, count=count),
+            lambda messages, cursor: self._messages_page(messages, count),
+            max_created_usec)
+
+    def _messages_page(self, messages, count):
+        """Returns the messages of a `get_messages` page, and the cursor for
+        the next page or None if this was the last."""
+        if len(messages) < count:
+            return messages, None
+        return messages, messages[-1]["created_usec"] - 1
+
+    def get_messages_cached(self, thread_id, updated_usec,
+                            max_created_usec=None, count=None):
+        """Like `get_messages`, but reads the messages from the client's
+        `thread_store` if they were stored for the thread's given
+        `updated_usec`, and stores them otherwise."""
+        messages = self.thread_store.get_messages(
+            thread_id, updated_usec, max_created_usec, count)
+        if messages is None:
+            messages = self.get_messages(thread_id, max_created_usec, count)
+            self.thread_store.put_messages(
+                thread_id, updated_usec, messages, max_created_usec, count)
+        return messages
+
     def new_message(self, thread_id, content=None, **kwargs):
         """Sends a message on the given thread.
 
@@ -251,7 +1692,39 @@ class QuipClient(object):
 
     def get_threads(self, ids):
         """Returns a dictionary of threads for the given IDs."""
-        return self._fetch_json("threads/", post_data={"ids": ",".join(ids)})
+        return self._fetch_batched("threads/", ids)
+
+    def iter_threads(self, ids):
+        """Like `get_threads`, but yields a dictionary for each batch of IDs as
+        soon as it arrives, so processing can start before the slowest batch
+        has finished.
+
+            client = quip.QuipClient(...)
+            for threads in client.iter_threads(thread_ids):
+                for thread in threads.values():
+                    ...
+
+        """
+        return self._iter_batched("threads/", ids)
+
+    def get_threads_cached(self, versions):
+        """Returns a dictionary of threads for the given dictionary of thread
+        IDs to `updated_usec`.
+
+        Threads whose given version is in the client's `thread_store` are
+        read from there; only the others are downloaded.
+        """
+        threads = {}
+        changed = []
+        for id, updated_usec in iteritems(dict(versions)):
+            thread = self.thread_store.get_thread(id, updated_usec)
+            if thread is None:
+                changed.append(id)
+            else:
+                threads[id] = thread
+        if changed:
+            threads.update(self.get_threads(changed))
+        return threads
 
     def get_recent_threads(self, max_updated_usec=None, count=None, **kwargs):
         """Returns the recently updated threads for a given user."""
@@ -265,6 +1738,71 @@ class QuipClient(object):
         return self._fetch_json("threads/search", query=query, count=count,
             only_match_titles=only_match_titles, **kwargs)
 
+    def iter_recent_threads(self, count=50, max_updated_usec=None, **kwargs):
+        """Yields all of the user's threads, most recently updated first.
+
+        Pages are requested with `get_recent_threads` and prefetched like in
+        `iter_messages`. Each thread is yielded once, even if it appears on
+        more than one page.
+        """
+        seen = {}
+        return self._prefetch_pages(
+            lambda cursor: self.get_recent_threads(
+                max_updated_usec=cursor, count=count, **kwargs),
+            lambda threads, cursor: self._threads_page(
+                threads, seen, cursor, count),
+            max_updated_usec)
+
+    def iter_matching_threads(self, query, count=50, only_match_titles=False,
+                              max_updated_usec=None, **kwargs):
+        """Yields all of the threads matching the given query, most recently
+        updated first, paging like `iter_recent_threads`."""
+        seen = {}
+        return self._prefetch_pages(
+            lambda cursor: self.get_matching_threads(
+                query, count=count, only_match_titles=only_match_titles,
+                max_updated_usec=cursor, **kwargs),
+            lambda threads, cursor: self._threads_page(
+                threads, seen, cursor, count),
+            max_updated_usec)
+
+    def _threads_page(self, threads, seen, cursor, count):
+        """Returns the threads of a page of threads that are not in `seen`,
+        most recently updated first, and the `max_updated_usec` cursor for the
+        next page or None if this was the last.
+
+        `seen` maps the IDs of the threads already returned to their
+        `updated_usec`. Only the ones the next page can repeat are kept, so
+        it stays small however many pages there are.
+        """
+        threads = sorted(threads.values(),
+                         key=lambda t: t["thread"]["updated_usec"],
+                         reverse=True)
+        fresh = [t for t in threads if t["thread"]["id"] not in seen]
+        seen.update((t["thread"]["id"], t["thread"]["updated_usec"])
+                    for t in fresh)
+        oldest = threads[-1]["thread"]["updated_usec"] if threads else None
+        if not threads:
+            next_cursor = None
+        elif fresh:
+            # More threads may share the oldest timestamp than fit on this
+            # page, so the next page starts at it rather than after it.
+            next_cursor = oldest
+        elif len(threads) < count or (
+                cursor is not None and oldest - 1 >= cursor):
+            # The server is not paging back any further.
+            next_cursor = None
+        else:
+            logging.warning("More threads were updated at %d than fit on a "
+                            "page; some of them may be skipped", oldest)
+            next_cursor = oldest - 1
+        # The next page only has threads updated at the cursor or before,
+        # and only the ones at the cursor can have been returned already.
+        for id, updated_usec in list(seen.items()):
+            if next_cursor is None or updated_usec > next_cursor:
+                del seen[id]
+        return fresh, next_cursor
+
     def add_thread_members(self, thread_id, member_ids):
         """Adds the given folder or user IDs to the given thread."""
         return self._fetch_json("threads/add-members", post_data={
@@ -381,12 +1919,13 @@ class QuipClient(object):
                     if section_id and section_id in parent_map:
                         kwargs["section_id"] = parent_map[section_id]
                 if "files" in message:
-                    attachments = []
-                    for blob_info in message["files"]:
-                        blob = self.get_blob(thread_id, blob_info["hash"])
-                        new_blob = self.put_blob(
-                            original_id, blob, name=blob_info["name"])
-                        attachments.append(new_blob["id"])
+                    # Copy the attachments concurrently.
+                    attachments = self._map_concurrently(
+                        lambda blob_info: self.put_blob(
+                            original_id,
+                            self.get_blob(thread_id, blob_info["hash"]),
+                            name=blob_info["name"])["id"],
+                        message["files"])
                     if attachments:
                         kwargs["attachments"] = ",".join(attachments)
                 self.new_message(original_id, **kwargs)
@@ -415,8 +1954,15 @@ class QuipClient(object):
         args.update(kwargs)
         return self._fetch_json("threads/edit-document", post_data=args)
 
+    def edit_buffer(self, thread_id, **kwargs):
+        """Returns an `EditBuffer` that merges consecutive edits of the given
+        thread into as few `edit_document` requests as possible."""
+        return EditBuffer(self, thread_id, **kwargs)
+
     def add_to_first_list(self, thread_id, *items, **kwargs):
-        """Adds the given items to the first list in the given document.
+        """Adds the given items to the first list in the given document. Pass
+        a `DocumentSnapshot` or the document's HTML as `document_html` to
+        avoid fetching it again.
 
             client = quip.QuipClient(...)
             client.add_to_first_list(thread_id, "Try the Quip API")
@@ -430,19 +1976,22 @@ class QuipClient(object):
             "operation": self.AFTER_SECTION
         }
         args.update(kwargs)
+        document_html = args.pop("document_html", None)
         if "section_id" not in args:
-            first_list = self.get_first_list(
-                thread_id, kwargs.pop("document_html", None))
+            first_list = self.get_first_list(thread_id, document_html)
             if first_list:
                 args["section_id"] = self.get_last_list_item_id(first_list)
         if not args.get("section_id"):
             args["operation"] = self.APPEND
             args["content"] = "\n\n".join(["    * %s" % i for i in items])
-        return self.edit_document(**args)
+        response = self.edit_document(**args)
+        self._refresh_snapshot(document_html, response)
+        return response
 
     def add_to_spreadsheet(self, thread_id, *rows, **kwargs):
         """Adds the given rows to the named (or first) spreadsheet in the
-        given document.
+        given document. Pass a `DocumentSnapshot` or the document's HTML as
+        `document_html` to avoid fetching it again.
 
             client = quip.QuipClient(...)
             client.add_to_spreadsheet(thread_id, ["5/1/2014", 2.24])
@@ -450,21 +1999,25 @@ class QuipClient(object):
         """
         content = "".join(["<tr>%s</tr>" % "".join(
             ["<td>%s</td>" % cell for cell in row]) for row in rows])
+        document_html = kwargs.get("document_html")
         if kwargs.get("name"):
-            spreadsheet = self.get_named_spreadsheet(kwargs["name"], thread_id)
+            spreadsheet = self.get_named_spreadsheet(
+                kwargs["name"], thread_id, document_html)
         else:
-            spreadsheet = self.get_first_spreadsheet(thread_id)
+            spreadsheet = self.get_first_spreadsheet(thread_id, document_html)
         if kwargs.get("add_to_top"):
             section_id = self.get_first_row_item_id(spreadsheet)
             operation = self.BEFORE_SECTION
         else:
             section_id = self.get_last_row_item_id(spreadsheet)
             operation = self.AFTER_SECTION
-        return self.edit_document(
+        response = self.edit_document(
             thread_id=thread_id,
             content=content,
             section_id=section_id,
             operation=operation)
+        self._refresh_snapshot(document_html, response)
+        return response
 
     def update_spreadsheet_row(self, thread_id, header, value, updates, **args):
         """Finds the row where the given header column is the given value, and
@@ -472,41 +2025,203 @@ class QuipClient(object):
         new value. In both cases headers can either be a string that matches, or
         "A", "B", "C", 1, 2, 3 etc. If no row is found, adds a new one.
 
+        To update many rows, pass a `DocumentSnapshot` of the document as
+        `document_html`: its spreadsheet is then indexed once and kept up to
+        date with the updated cells, and the snapshot is refreshed from the
+        response when a row is added.
+
             client = quip.QuipClient(...)
             client.update_spreadsheet_row(
                 thread_id, "customer", "Acme", {"Billed": "6/24/2015"})
 
         """
         response = None
+        document_html = args.pop("document_html", None)
         if args.get("name"):
-            spreadsheet = self.get_named_spreadsheet(args["name"], thread_id)
+            spreadsheet = self.get_named_spreadsheet(
+                args["name"], thread_id, document_html)
         else:
-            spreadsheet = self.get_first_spreadsheet(thread_id)
-        headers = self.get_spreadsheet_header_items(spreadsheet)
-        row = self.find_row_from_header(spreadsheet, header, value)
-        if row:
+            spreadsheet = self.get_first_spreadsheet(thread_id, document_html)
+        index = self.get_spreadsheet_index(spreadsheet, document_html)
+        headers = index.headers
+        row = index.find(header, value)
+        if row is not None:
             ids = self.get_row_ids(row)
             for head, val in iteritems(updates):
-                index = self.get_index_of_header(headers, head)
-                if not index or index >= len(ids) or not ids[index]:
+                column = self.get_index_of_header(headers, head)
+                if not column or column >= len(ids) or not ids[column]:
                     continue
                 response = self.edit_document(
                     thread_id=thread_id,
                     content=val,
                     format="markdown",
-                    section_id=ids[index],
+                    section_id=ids[column],
                     operation=self.REPLACE_SECTION,
                     **args)
+                index.set_cell(row, column, val)
         else:
             updates[header] = value
             response = self.add_spreadsheet_row(
                 thread_id, spreadsheet, updates, headers=headers, **args)
+            self._refresh_snapshot(document_html, response)
         return response
 
     def add_spreadsheet_row(
             self, thread_id, spreadsheet, updates, headers=None, **args):
         if not headers:
             headers = self.get_spreadsheet_header_items(spreadsheet)
+        content = self._spreadsheet_row_html(headers, updates)
+        section_id = self.get_last_row_item_id(spreadsheet)
+        response = self.edit_document(
+            thread_id=thread_id,
+            content=content,
+            section_id=section_id,
+            operation=self.AFTER_SECTION,
+            **args)
+        return response
+
+    def upsert_spreadsheet_rows(self, thread_id, key_header, rows, name=None):
+        """Applies many row updates to the named (or first) spreadsheet in the
+        given document at once.
+
+        `rows` is a list of dicts from header to value, like the `updates` of
+        `update_spreadsheet_row`, which each include `key_header`. The row
+        whose `key_header` cell matches is updated, and rows that match none
+        are added at the end of the spreadsheet; a key shared by several
+        rows updates the first. The document is fetched once, cells that
+        already hold their value are left alone, a row with changed cells is
+        replaced in one edit, and all new rows are added in one edit. Values
+        are sent as text, not HTML. Returns the responses of the edits, in
+        order. Raises `ValueError` if one of `rows` has an empty key.
+
+            client = quip.QuipClient(...)
+            client.upsert_spreadsheet_rows(thread_id, "customer", [
+                {"customer": "Acme", "Billed": "6/24/2015"},
+                {"customer": "Initech", "Billed": "6/25/2015"},
+            ])
+
+        """
+        if name:
+            spreadsheet = self.get_named_spreadsheet(name, thread_id)
+        else:
+            spreadsheet = self.get_first_spreadsheet(thread_id)
+        return [self.edit_document(thread_id=thread_id, **edit) for edit in
+                self._spreadsheet_sync_edits(
+                    spreadsheet, key_header, rows, delete_missing=False)]
+
+    def sync_spreadsheet(self, thread_id, key_header, rows, name=None,
+                         delete_missing=True):
+        """Makes the named (or first) spreadsheet in the given document hold
+        the given rows, with as few edits as possible.
+
+        `rows` is a list of dicts from header to value, like those of
+        `upsert_spreadsheet_rows`, identified by their `key_header` cell.
+        The spreadsheet is read once and compared cell by cell: changed cells
+        and rows are replaced, and rows whose key is not in `rows` are
+        deleted, unless `delete_missing` is False. If several rows share a
+        key, the first is updated and the others count as missing. Rows with
+        an empty key cell, such as the blank rows at the end of a
+        spreadsheet, and columns missing from `rows` are left alone. New rows
+        take the place of deleted rows first, and the rest are added at the
+        end in a single edit. If the spreadsheet already matches, no edit is
+        made. Returns the responses of the edits, in order. Raises
+        `ValueError` if one of `rows` has an empty key.
+        """
+        if name:
+            spreadsheet = self.get_named_spreadsheet(name, thread_id)
+        else:
+            spreadsheet = self.get_first_spreadsheet(thread_id)
+        return [self.edit_document(thread_id=thread_id, **edit)
+                for edit in self._spreadsheet_sync_edits(
+                    spreadsheet, key_header, rows, delete_missing)]
+
+    def _spreadsheet_sync_edits(self, spreadsheet, key_header, rows,
+                                delete_missing):
+        """Returns the `edit_document` arguments that apply the given rows to
+        the spreadsheet `ElementTree`, for `upsert_spreadsheet_rows` and
+        `sync_spreadsheet`."""
+        index = SpreadsheetIndex(spreadsheet)
+        headers = index.headers
+        key_column = self.get_index_of_header(headers, key_header)
+        updates = collections.OrderedDict()
+        for values in rows:
+            key = _normalize_cell_text(values[key_header])
+            if not key:
+                # Blank keys never match a row, so it would be added again
+                # on every sync.
+                raise ValueError("Row has an empty %r: %r" % (
+                    key_header, values))
+            updates.setdefault(key, {}).update(values)
+        matched = {}
+        deleted = []
+        for row in index.rows:
+            key = index._key(row, (key_column,))
+            if key is None or not key[0]:
+                continue
+            if key[0] in updates and key[0] not in matched:
+                matched[key[0]] = row
+            elif delete_missing:
+                deleted.append(row)
+        edits = []
+        new_rows = []
+        for key, values in iteritems(updates):
+            row = matched.get(key)
+            if row is None:
+                new_rows.append(self._spreadsheet_row_html(
+                    headers, values, escape=True))
+                continue
+            cells = list(row)
+            changed = {}
+            for head, value in iteritems(values):
+                column = self.get_index_of_header(headers, head)
+                if (not column or column >= len(cells) or
+                        not cells[column].attrib.get("id")):
+                    continue
+                if _cell_full_text(cells[column]) != u"%s" % value:
+                    changed[column] = value
+            if changed:
+                # Changes go out as the whole row, in the same escaped HTML
+                # as new rows, whether one cell changed or several.
+                edits.append({
+                    "content": "<tr>%s</tr>" % "".join(
+                        "<td>%s</td>" % _escape_cell(changed[i])
+                        if i in changed else self._cell_html(cell)
+                        for i, cell in enumerate(cells)),
+                    "section_id": row.attrib["id"],
+                    "operation": self.REPLACE_SECTION,
+                })
+        # Replacing a deleted row with a new one takes one edit instead of
+        # a deletion plus a share of the insertion.
+        replaced = set()
+        while deleted and new_rows:
+            row = deleted.pop(0)
+            replaced.add(row)
+            edits.append({
+                "content": new_rows.pop(0),
+                "section_id": row.attrib["id"],
+                "operation": self.REPLACE_SECTION,
+            })
+        for row in deleted:
+            edits.append({
+                "content": "",
+                "section_id": row.attrib["id"],
+                "operation": self.DELETE_SECTION,
+            })
+        if new_rows:
+            # Rows are only left over when none were deleted, but the last
+            # row may have been replaced.
+            anchor = [r for r in list(spreadsheet.iterfind(".//tr"))
+                      if r not in replaced][-1]
+            edits.append({
+                "content": "".join(new_rows),
+                "section_id": anchor.attrib["id"],
+                "operation": self.AFTER_SECTION,
+            })
+        return edits
+
+    def _spreadsheet_row_html(self, headers, updates, escape=False):
+        """Returns the HTML of a new spreadsheet row with the given updates,
+        which are escaped if `escape` is true rather than sent as HTML."""
         indexed_items = {}
         extra_items = []
         for head, val in iteritems(updates):
@@ -526,16 +2241,19 @@ class QuipClient(object):
                 else:
                     cells.append("")
         cells.extend(extra_items)
-        content = "<tr>%s</tr>" % "".join(
+        if escape:
+            cells = [_escape_cell(cell) for cell in cells]
+        return "<tr>%s</tr>" % "".join(
             ["<td>%s</td>" % cell for cell in cells])
-        section_id = self.get_last_row_item_id(spreadsheet)
-        response = self.edit_document(
-            thread_id=thread_id,
-            content=content,
-            section_id=section_id,
-            operation=self.AFTER_SECTION,
-            **args)
-        return response
+
+    def _cell_html(self, cell):
+        """Returns the HTML of the given cell `ElementTree`, without its ID, to
+        send it back unchanged in a replaced row."""
+        cell = copy.copy(cell)
+        cell.attrib = dict(cell.attrib)
+        cell.attrib.pop("id", None)
+        cell.tail = None
+        return xml.etree.cElementTree.tostring(cell).decode("utf-8")
 
     def toggle_checkmark(self, thread_id, item, checked=True):
         """Sets the checked state of the given list item to the given state.
@@ -560,7 +2278,7 @@ class QuipClient(object):
         The list can be any type (bulleted, numbered, or checklist).
         If `thread_id` is given, we download the document. If you have
         already downloaded the document, you can specify `document_html`
-        directly.
+        directly, or a `DocumentSnapshot` of it.
         """
         return self._get_container(thread_id, document_html, "ul", 0)
 
@@ -569,34 +2287,25 @@ class QuipClient(object):
         return self._get_container(thread_id, document_html, "ul", -1)
 
     def get_section(self, section_id, thread_id=None, document_html=None):
-        if not document_html:
-            document_html = self.get_thread(thread_id).get("html")
-            if not document_html:
-                return None
-        tree = self.parse_document_html(document_html)
-        element = list(tree.iterfind(".//*[@id='%s']" % section_id))
-        if not element:
-            return None
-        return element[0]
+        document = self._document(thread_id, document_html)
+        if isinstance(document, DocumentSnapshot):
+            return document.find_by_id(section_id)
+        return self._find_in_sections(
+            document, lambda e: e.attrib.get("id") == section_id)
 
     def get_named_spreadsheet(self, name, thread_id=None, document_html=None):
-        if not document_html:
-            document_html = self.get_thread(thread_id).get("html")
-            if not document_html:
-                return None
-        tree = self.parse_document_html(document_html)
-        element = list(tree.iterfind(".//*[@title='%s']" % name))
-        if not element:
-            return None
-        return element[0]
+        document = self._document(thread_id, document_html)
+        if isinstance(document, DocumentSnapshot):
+            return document.find_by_title(name)
+        return self._find_in_sections(
+            document, lambda e: e.attrib.get("title") == name)
 
     def _get_container(self, thread_id, document_html, container, index):
-        if not document_html:
-            document_html = self.get_thread(thread_id).get("html")
-            if not document_html:
-                return None
-        tree = self.parse_document_html(document_html)
-        lists = list(tree.iter(container))
+        document = self._document(thread_id, document_html)
+        if not isinstance(document, DocumentSnapshot):
+            return self._find_in_sections(
+                document, lambda e: e.tag == container, index)
+        lists = document.find_all(container)
         if not lists:
             return None
         try:
@@ -604,6 +2313,57 @@ class QuipClient(object):
         except IndexError:
             return None
 
+    def _document(self, thread_id, document_html):
+        """Returns `document_html`, fetching the thread's document if it is
+        not given, or None if there is none."""
+        if not document_html:
+            document_html = self.get_thread(thread_id).get("html")
+        return document_html or None
+
+    def _find_in_sections(self, document_html, match, index=0):
+        """Returns the `index`th element of the document HTML for which
+        `match` is true, or None, parsing no more of the document than
+        needed."""
+        if document_html is None:
+            return None
+        found = collections.deque(maxlen=-index if index < 0 else None)
+        for section in self.iter_document_sections(document_html):
+            for element in section.iter():
+                if match(element):
+                    found.append(element)
+                    if index >= 0 and len(found) > index:
+                        return element
+        if index < 0 and len(found) == -index:
+            return found[0]
+        return None
+
+    def snapshot(self, thread_id=None, thread=None):
+        """Returns a `DocumentSnapshot` of the given thread's document, which
+        the document helpers accept in place of `document_html`.
+
+        To snapshot a response you already have, such as the one returned by
+        `edit_document`, pass it as `thread` instead of a `thread_id`.
+
+            client = quip.QuipClient(...)
+            snapshot = client.snapshot(thread_id)
+            spreadsheet = client.get_first_spreadsheet(document_html=snapshot)
+            section = client.get_section(section_id, document_html=snapshot)
+        """
+        if thread is None:
+            thread = self.get_thread(thread_id)
+        html = thread.get("html")
+        return DocumentSnapshot(
+            self.parse_document_html(html) if html else None, thread)
+
+    def _refresh_snapshot(self, document_html, response):
+        """Replaces the contents of a `DocumentSnapshot` passed as
+        `document_html` with the document in an edit's response, after an
+        edit that adds sections its indexes do not know the IDs of."""
+        if isinstance(document_html, DocumentSnapshot) and response and \
+                response.get("html"):
+            document_html._reset(
+                self.parse_document_html(response["html"]), response)
+
     def get_last_list_item_id(self, list_tree):
         """Returns the last item in the given list `ElementTree`."""
         items = list(list_tree.iter("li"))
@@ -620,7 +2380,7 @@ class QuipClient(object):
 
         If `thread_id` is given, we download the document. If you have
         already downloaded the document, you can specify `document_html`
-        directly.
+        directly, or a `DocumentSnapshot` of it.
         """
         return self._get_container(thread_id, document_html, "table", 0)
 
@@ -652,43 +2412,26 @@ class QuipClient(object):
 
     def get_index_of_header(self, header_items, header, default=0):
         """Find the index of the given header in the items"""
-        if header:
-            header = str(header)
-            lower_headers = [str(h).lower() for h in header_items]
-            if header in header_items:
-                return header_items.index(header)
-            elif header.lower() in lower_headers:
-                return lower_headers.index(header.lower())
-            elif header.isdigit():
-                return int(header)
-            elif len(header) == 1:
-                char = ord(header.upper())
-                if ord('A') < char < ord('Z'):
-                    return char - ord('A') + 1
-            else:
-                pass
-        return default
+        return _index_of_header(header_items, header, default)
 
     def find_row_from_header(self, spreadsheet_tree, header, value):
         """Find the row in the given spreadsheet `ElementTree` where header is
-        value.
+        value. To look up many rows, use a `SpreadsheetIndex` instead.
         """
-        headers = self.get_spreadsheet_header_items(spreadsheet_tree)
-        index = self.get_index_of_header(headers, header)
-        for row in spreadsheet_tree.iterfind(".//tr"):
-            if len(row) <= index:
-                continue
-            cell = row[index]
-            if cell.tag != "td":
-                continue
-            if list(cell.itertext())[0].lower() == value.lower():
-                return row
+        return SpreadsheetIndex(spreadsheet_tree).find(header, value)
+
+    def get_spreadsheet_index(self, spreadsheet_tree, document_html=None):
+        """Returns a `SpreadsheetIndex` of the given spreadsheet `ElementTree`.
+        If the spreadsheet comes from a `DocumentSnapshot` given as
+        `document_html`, the snapshot's index of it is reused."""
+        if isinstance(document_html, DocumentSnapshot):
+            return document_html.get_spreadsheet_index(spreadsheet_tree)
+        return SpreadsheetIndex(spreadsheet_tree)
 
     def parse_spreadsheet_contents(self, spreadsheet_tree):
         """Returns a python-friendly representation of the given spreadsheet
         `ElementTree`
         """
-        import collections
         spreadsheet = {
             "id": spreadsheet_tree.attrib.get("id"),
             "headers": self.get_spreadsheet_header_items(spreadsheet_tree),
@@ -704,27 +2447,117 @@ class QuipClient(object):
                     continue
                 data = {
                     "id": cell.attrib.get("id"),
+                    "content": _cell_content(cell),
                 }
-                images = list(cell.iter("img"))
-                if images:
-                    data["content"] = images[0].attrib.get("src")
-                else:
-                    data["content"] = list(cell.itertext())[0].replace(
-                        u"\u200b", "")
-                style = cell.attrib.get("style")
-                if style and "background-color:#" in style:
-                    sharp = style.find("#")
-                    data["color"] = style[sharp + 1:sharp + 7]
+                color = _cell_color(cell)
+                if color:
+                    data["color"] = color
                 value["cells"][spreadsheet["headers"][i]] = data
             if len(value["cells"]):
                 spreadsheet["rows"].append(value)
         return spreadsheet
 
+    def parse_spreadsheet_columns(self, spreadsheet_tree, infer_types=True,
+                                  use_numpy=True):
+        """Returns a columnar representation of the given spreadsheet
+        `ElementTree`, which is far more compact than the one returned by
+        `parse_spreadsheet_contents` and suits vectorized analysis.
+
+        The result is a dict with the spreadsheet's "id", its "headers" and
+        the "row_ids" of its rows below the header row, and three dicts from
+        column name (the header, or the column's index if it has no header
+        or a repeated one) to:
+
+        - "columns": the values of the column, as a NumPy array if NumPy is
+          installed and `use_numpy`, or else as an `array.array` of numbers
+          or a list.
+        - "cell_ids": the IDs of the column's cells.
+        - "colors": a dict from row position to background color, for the
+          column's colored cells only.
+
+        With `infer_types`, a column whose non-empty cells all hold integers,
+        numbers or dates holds ints, floats or `datetime.date`s (NumPy
+        `datetime64`s). Empty cells are NaN in number columns and None (NaT)
+        in date columns. Other columns hold text.
+
+            client = quip.QuipClient(...)
+            spreadsheet = client.get_first_spreadsheet(thread_id)
+            columns = client.parse_spreadsheet_columns(spreadsheet)["columns"]
+            total = columns["Amount"][columns["Region"] == "EMEA"].sum()
+        """
+        rows = list(spreadsheet_tree.iterfind(".//tr"))
+        headers = self.get_row_items(rows[0]) if rows else []
+        names = []
+        for i, header in enumerate(headers):
+            header = (header or u"").replace(u"\u200b", "").strip()
+            names.append(header if header and header not in names else i)
+        texts = [[] for _ in names]
+        cell_ids = [[] for _ in names]
+        colors = [{} for _ in names]
+        row_ids = []
+        for row in rows[1:]:
+            cells = [cell if cell.tag == "td" else None for cell in row]
+            if not any(cell is not None for cell in cells):
+                continue
+            position = len(row_ids)
+            row_ids.append(row.attrib.get("id"))
+            for i in range(len(names)):
+                cell = cells[i] if i < len(cells) else None
+                if cell is None:
+                    texts[i].append(u"")
+                    cell_ids[i].append(None)
+                    continue
+                texts[i].append(_cell_content(cell) or u"")
+                cell_ids[i].append(cell.attrib.get("id"))
+                color = _cell_color(cell)
+                if color:
+                    colors[i][position] = color
+        numpy = _numpy() if use_numpy else None
+        return {
+            "id": spreadsheet_tree.attrib.get("id"),
+            "headers": headers,
+            "row_ids": row_ids,
+            "columns": collections.OrderedDict(
+                (name, _column_array(column, infer_types, numpy))
+                for name, column in zip(names, texts)),
+            "cell_ids": collections.OrderedDict(zip(names, cell_ids)),
+            "colors": collections.OrderedDict(zip(names, colors)),
+        }
+
     def parse_document_html(self, document_html):
         """Returns an `ElementTree` for the given Quip document HTML"""
         document_xml = "<html>" + document_html + "</html>"
         return xml.etree.cElementTree.fromstring(document_xml.encode("utf-8"))
 
+    def iter_document_sections(self, document_html):
+        """Yields the top-level sections of the given Quip document HTML (its
+        paragraphs, headings, lists, spreadsheets, ...) as `ElementTree`s,
+        parsing the document incrementally.
+
+        Unlike `parse_document_html`, the whole document is never in memory:
+        each section is yielded as soon as it has been parsed and dropped
+        from the document afterwards, and stopping early leaves the rest of
+        the document unparsed.
+
+            client = quip.QuipClient(...)
+            for section in client.iter_document_sections(thread["html"]):
+                if section.tag == "table":
+                    rows = client.parse_spreadsheet_contents(section)["rows"]
+        """
+        root = None
+        depth = 0
+        for event, element in xml.etree.cElementTree.iterparse(
+                _DocumentReader(document_html), events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                yield element
+                root.remove(element)
+
     def parse_micros(self, usec):
         """Returns a `datetime` for the given microsecond string"""
         return datetime.datetime.utcfromtimestamp(usec / 1000000.0)
@@ -733,15 +2566,15 @@ class QuipClient(object):
         """Returns a file-like object with the contents of the given blob from
         the given thread.
 
-        The object is described in detail here:
+        The object supports the same methods as the one returned by `urlopen`:
         https://docs.python.org/2/library/urllib2.html#urllib2.urlopen
+        Its connection goes back to the client's pool once it has been read
+        to the end or closed.
         """
-        request = Request(
-            url=self._url("blob/%s/%s" % (thread_id, blob_id)))
-        if self.access_token:
-            request.add_header("Authorization", "Bearer " + self.access_token)
         try:
-            return urlopen(request, timeout=self.request_timeout)
+            return self._request(
+                "GET", self._url("blob/%s/%s" % (thread_id, blob_id)),
+                headers=self._headers())
         except HTTPError as error:
             try:
                 # Extract the developer-friendly error message from the response
@@ -750,32 +2583,266 @@ class QuipClient(object):
                 raise error
             raise QuipError(error.code, message, error)
 
-    def put_blob(self, thread_id, blob, name=None):
+    def download_blob(self, thread_id, blob_id, dest, chunk_size=64 * 1024,
+                      resume=False):
+        """Downloads the given blob from the given thread to `dest` and
+        returns the response headers (e.g. for its Content-Disposition).
+
+        `dest` can be a file path, a file descriptor or a binary file-like
+        object. The blob is streamed in `chunk_size` pieces through a single
+        reusable buffer, so memory use does not grow with its size. If the
+        transfer is interrupted, it continues where it stopped with an HTTP
+        Range request, as often as the client's `RateLimiter` allows
+        retries. If `resume` is true and `dest` is the path of a partially
+        downloaded file, the download continues from its end; if the file
+        is already complete, only its last byte is requested again, for the
+        headers.
+
+        Raises `IOError` if the number of bytes received does not match the
+        length announced by the server.
+        """
+        write, rewind, offset, close = self._blob_destination(dest, resume)
+        url = self._url("blob/%s/%s" % (thread_id, blob_id))
+        view = memoryview(bytearray(chunk_size))
+        info = None
+        attempt = 0
+        try:
+            while True:
+                headers = self._headers()
+                if offset:
+                    headers["Range"] = "bytes=%d-" % offset
+                try:
+                    response = self._request("GET", url, headers=headers)
+                except HTTPError as error:
+                    if error.code == 416 and offset:
+                        # We already have the whole blob, unless the server
+                        # says it is shorter than our file.
+                        self._check_blob_tail(_content_range_total(
+                            error.hdrs.get("Content-Range")), offset, blob_id)
+                        info = self._blob_tail_info(url, offset, blob_id) or \
+                            error.hdrs
+                        break
+                    try:
+                        # Extract the developer-friendly error message from the response
+                        message = json.loads(
+                            error.read().decode())["error_description"]
+                    except Exception:
+                        raise error
+                    raise QuipError(error.code, message, error)
+                info = info or response.info()
+                if offset and response.status != 206:
+                    # The server ignored the range, so start over.
+                    if rewind is None:
+                        response.close()
+                        raise IOError("Cannot restart the download of blob "
+                                      "%s on an unseekable file" % blob_id)
+                    rewind()
+                    offset = 0
+                total = self._blob_length(response, offset)
+                error = None
+                try:
+                    while True:
+                        n = response.readinto(view)
+                        if not n:
+                            break
+                        write(view[:n])
+                        offset += n
+                except (HTTPException, socket.error) as e:
+                    response.close()
+                    error = e
+                if not error and (total is None or offset == total):
+                    break
+                delay = None
+                if total is None or offset < total:
+                    delay = self.rate_limiter.retry_delay(attempt)
+                if delay is None:
+                    if error:
+                        raise error
+                    raise IOError("Received %d of %d bytes of blob %s" % (
+                        offset, total, blob_id))
+                logging.info("Resuming %s at byte %d after %r",
+                             url, offset, error or "a short read")
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            if close:
+                close.close()
+        return info
+
+    def _blob_tail_info(self, url, offset, blob_id):
+        """Returns the headers of a blob that is already complete at
+        `offset` bytes, from a request for its last byte, or None if they
+        cannot be fetched."""
+        headers = self._headers()
+        headers["Range"] = "bytes=%d-%d" % (offset - 1, offset - 1)
+        try:
+            response = self._request("GET", url, headers=headers)
+        except HTTPError:
+            return None
+        response.read()
+        self._check_blob_tail(
+            self._blob_length(response, offset - 1), offset, blob_id)
+        return response.info()
+
+    def _check_blob_tail(self, total, offset, blob_id):
+        if total is not None and total != offset:
+            raise IOError("Have %d bytes of blob %s, which has %d" % (
+                offset, blob_id, total))
+
+    def _blob_destination(self, dest, resume):
+        """Returns a `write` function for the `dest` of `download_blob`, a
+        `rewind` function that truncates it back to where the download
+        started (or None if it cannot), the offset to resume the download
+        from, and the file to close once done, if any."""
+        import os
+        close = None
+        offset = 0
+        if not isinstance(dest, int) and not hasattr(dest, "write"):
+            if resume and os.path.exists(dest):
+                dest = close = open(dest, "ab")
+                offset = os.fstat(dest.fileno()).st_size
+            else:
+                dest = close = open(dest, "wb")
+        if isinstance(dest, int):
+            def write(data):
+                while data:
+                    data = data[os.write(dest, data):]
+
+            def rewind():
+                os.lseek(dest, base, os.SEEK_SET)
+                os.ftruncate(dest, base)
+            try:
+                base = os.lseek(dest, 0, os.SEEK_CUR) - offset
+            except OSError:
+                base = None
+        else:
+            write = dest.write
+
+            def rewind():
+                dest.seek(base)
+                dest.truncate()
+            try:
+                base = dest.tell() - offset
+            except (AttributeError, IOError, OSError):
+                base = None
+        return write, rewind if base is not None else None, offset, close
+
+    def _blob_length(self, response, offset):
+        """Returns the total length of a blob from the headers of a (partial)
+        response starting at `offset`, or None if it is not known."""
+        total = _content_range_total(response.getheader("Content-Range"))
+        if total is not None:
+            return total
+        length = response.getheader("Content-Length")
+        if length is not None and length.isdigit():
+            return offset + int(length) if response.status == 206 else \
+                int(length)
+        return None
+
+    def put_blob(self, thread_id, blob, name=None, progress=None):
         """Uploads an image or other blob to the given Quip thread. Returns an
         ID that can be used to add the image to the document of the thread.
 
-        blob can be any file-like object. Requires the 'requests' module.
+        blob can be a file-like object (including an `mmap`), a byte string,
+        or an iterable of byte strings. It is streamed to the server without
+        being read into memory; blobs of unknown length are first spooled to
+        a temporary file. If given, `progress` is called as
+        `progress(bytes_sent, total_bytes)` during the upload.
         """
-        import requests
-        url = "blob/" + thread_id
-        headers = None
-        if self.access_token:
-            headers = {"Authorization": "Bearer " + self.access_token}
-        if name:
-            blob = (name, blob)
+        body, headers = self._blob_upload_body(blob, name, progress)
         try:
-            response = requests.request(
-                "post", self._url(url), timeout=self.request_timeout,
-                files={"blob": blob}, headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as error:
+            response = self._request(
+                "POST", self._url("blob/" + thread_id), body=body,
+                headers=headers)
+            return self.json_decoder(response.read())
+        except HTTPError as error:
             try:
                 # Extract the developer-friendly error message from the response
-                message = error.response.json()["error_description"]
+                message = json.loads(error.read().decode())["error_description"]
             except Exception:
                 raise error
-            raise QuipError(error.response.status_code, message, error)
+            raise QuipError(error.code, message, error)
+
+    def put_blobs(self, thread_id, blobs, progress=None):
+        """Uploads the given blobs to the given thread concurrently, on up to
+        `max_workers` threads, and returns their responses in order.
+
+        Each of `blobs` is either a blob or a `(name, blob)` pair, as accepted
+        by `put_blob`. If given, `progress` is called as
+        `progress(index, bytes_sent, total_bytes)`.
+        """
+        def upload(item):
+            index, blob = item
+            name = None
+            if isinstance(blob, tuple):
+                name, blob = blob
+            return self.put_blob(
+                thread_id, blob, name=name, progress=progress and (
+                    lambda sent, total: progress(index, sent, total)))
+        return self._map_concurrently(upload, list(enumerate(blobs)))
+
+    def _blob_upload_body(self, blob, name, progress=None):
+        """Returns the `MultipartBody` and headers for `put_blob`."""
+        import mimetypes
+        import os
+        import uuid
+        if not name:
+            name = os.path.basename(getattr(blob, "name", None) or "blob")
+        if isinstance(blob, (bytearray, memoryview)):
+            blob = bytes(blob)
+        elif isinstance(blob, type(u"")):
+            blob = blob.encode("utf-8")
+        if isinstance(blob, bytes):
+            data = blob
+        else:
+            data = self._blob_file(blob)
+        boundary = uuid.uuid4().hex
+        content_type = mimetypes.guess_type(name)[0] or \
+            "application/octet-stream"
+        body = MultipartBody([
+            ("--%s\r\n" % boundary).encode(),
+            ('Content-Disposition: form-data; name="blob"; filename="%s"\r\n'
+             % name.replace('"', "")).encode("utf-8"),
+            ("Content-Type: %s\r\n\r\n" % content_type).encode(),
+            data,
+            ("\r\n--%s--\r\n" % boundary).encode(),
+        ], progress=progress)
+        headers = self._headers()
+        headers["Content-Type"] = "multipart/form-data; boundary=" + boundary
+        headers["Content-Length"] = str(body.length)
+        return body, headers
+
+    def _blob_file(self, blob):
+        """Returns a `(file, length)` pair for the rest of the given file-like
+        or iterable blob, spooling it to a temporary file if its length
+        cannot be known up front."""
+        import os
+        import tempfile
+        if hasattr(blob, "read"):
+            try:
+                position = blob.tell()
+                if hasattr(blob, "size"):
+                    # mmap
+                    return blob, len(blob) - position
+                try:
+                    return blob, os.fstat(blob.fileno()).st_size - position
+                except Exception:
+                    blob.seek(0, 2)
+                    length = blob.tell() - position
+                    blob.seek(position)
+                    return blob, length
+            except Exception:
+                chunks = iter(lambda: blob.read(64 * 1024), b"")
+        else:
+            chunks = blob
+        spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            spool.write(chunk)
+        length = spool.tell()
+        spool.seek(0)
+        return spool, length
 
     def new_websocket(self, **kwargs):
         """Gets a websocket URL to connect to.
@@ -783,22 +2850,61 @@ class QuipClient(object):
         return self._fetch_json("websockets/new", **kwargs)
 
     def _fetch_json(self, path, post_data=None, **args):
-        request = Request(url=self._url(path, **args))
-        if post_data:
-            post_data = dict((k, v) for k, v in post_data.items()
-                             if v or isinstance(v, int))
-            request_data = urlencode(self._clean(**post_data))
-            if PY3:
-                request.data = request_data.encode()
+        result = self._cached_response(path, post_data, args)
+        if result is not None:
+            return result
+        method, url, body, headers = self._json_request(
+            path, post_data, **args)
+        try:
+            if method == "GET" and self._in_flight:
+                result = self._in_flight.do(
+                    url, lambda: self._send_json(method, url, body, headers))
             else:
-                request.data = request_data
+                result = self._send_json(method, url, body, headers)
+        finally:
+            # A failed write may still have been applied.
+            self._invalidate_written(path, post_data)
+        self._cache_response(path, post_data, args, result)
+        return result
+
+    def _cached_response(self, path, post_data, args):
+        if self.cache is not None and not post_data and not args and \
+                self.cache.cacheable(path):
+            return self.cache.get(path)
+        return None
 
-        if self.access_token:
-            request.add_header("Authorization", "Bearer " + self.access_token)
+    def _cache_response(self, path, post_data, args, result):
+        if self.thread_store is not None and path.startswith("threads/"):
+            if path == "threads/":
+                threads = result.values()
+            elif not post_data and not args and "thread" in result:
+                threads = [result]
+            else:
+                threads = []
+            for thread in threads:
+                if "thread" in thread:
+                    self.thread_store.put_thread(thread)
+        if self.cache is None:
+            return
+        if path in ("threads/", "threads/recent", "threads/search"):
+            for thread in result.values():
+                if "thread" in thread:
+                    self.cache.observe_thread(thread)
+        elif not post_data and not args:
+            self.cache.put(path, result)
+
+    def _invalidate_written(self, path, post_data):
+        if self.cache is None or not post_data:
+            return
+        for prefix, arg in self._WRITE_INVALIDATIONS.get(path, []):
+            for id in (post_data.get(arg) or "").split(","):
+                if id:
+                    self.cache.invalidate(prefix + id)
+
+    def _send_json(self, method, url, body, headers):
         try:
-            return json.loads(
-                urlopen(
-                    request, timeout=self.request_timeout).read().decode())
+            return self.json_decoder(_read_decoded(self._request(
+                method, url, body=body, headers=headers)))
         except HTTPError as error:
             try:
                 # Extract the developer-friendly error message from the response
@@ -807,6 +2913,181 @@ class QuipClient(object):
                 raise error
             raise QuipError(error.code, message, error)
 
+    def _fetch_batched(self, path, ids):
+        results = {}
+        for batch in self._iter_batched(path, ids):
+            results.update(batch)
+        return results
+
+    def _iter_batched(self, path, ids, isolate_errors=False):
+        """Yields the results of `path` for `ids`, split into batches of at
+        most `batch_size` IDs that are fetched on a pool of `max_workers`
+        threads. Results are yielded in the order they arrive.
+
+        With `isolate_errors`, a batch that fails is retried one ID at a
+        time, and the IDs that still fail (e.g. restricted ones) are logged
+        and left out of the results.
+        """
+        ids = list(ids)
+        batches = [ids[i:i + self.batch_size]
+                   for i in range(0, len(ids), self.batch_size)]
+        fetch = lambda batch: self._fetch_json(
+            path, post_data={"ids": ",".join(batch)})
+        if isolate_errors:
+            fetch = lambda batch: self._fetch_isolated(path, batch)
+        if len(batches) <= 1:
+            yield fetch(ids)
+            return
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.max_workers, len(batches)))
+        try:
+            for result in pool.imap_unordered(fetch, batches):
+                yield result
+        finally:
+            pool.terminate()
+
+    def _fetch_isolated(self, path, ids):
+        try:
+            return self._fetch_json(path, post_data={"ids": ",".join(ids)})
+        except (QuipError, HTTPError) as error:
+            if len(ids) <= 1:
+                logging.warning("Skipped %s%s: %s", path, ",".join(ids), error)
+                return {}
+        results = {}
+        for id in ids:
+            results.update(self._fetch_isolated(path, [id]))
+        return results
+
+    def _prefetch_pages(self, fetch, page, cursor):
+        """Yields the items of consecutive pages, fetching each page on a
+        background thread while the caller consumes the previous one.
+
+        `fetch(cursor)` returns a response, and `page(response, cursor)`
+        returns its items and the next cursor, or None after the last page.
+        When the generator is closed, it waits for the page being fetched, if
+        any, and fetches no more.
+        """
+        pages = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce(cursor):
+            try:
+                while not stop.is_set():
+                    items, cursor = page(fetch(cursor), cursor)
+                    if items:
+                        put((items, None))
+                    if cursor is None:
+                        break
+                put((None, None))
+            except Exception as error:
+                put((None, error))
+
+        producer = threading.Thread(target=produce, args=(cursor,))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                items, error = pages.get()
+                if error:
+                    raise error
+                if items is None:
+                    return
+                for item in items:
+                    yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def _map_concurrently(self, fn, items):
+        """Returns `[fn(item) for item in items]`, computed on a pool of up to
+        `max_workers` threads."""
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.max_workers, len(items)))
+        try:
+            return pool.map(fn, items)
+        finally:
+            pool.terminate()
+
+    def _request(self, method, url, body=None, headers=None):
+        """Sends a request through the connection pool, paced by the rate
+        limiter. Throttled and transient failures are retried."""
+        waited = 0.0
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                time.sleep(delay)
+                waited += delay
+            try:
+                response = self.connection_pool.request(
+                    method, url, body=body, headers=headers,
+                    timeout=self.request_timeout)
+                self.rate_limiter.update(response.msg)
+                break
+            except HTTPError as error:
+                self.rate_limiter.update(error.hdrs)
+                delay = self.rate_limiter.retry_delay(
+                    attempt, error.code, error.hdrs, method)
+                if delay is None:
+                    self._report_wait(method, url, waited)
+                    raise
+                logging.info("Retrying %s after HTTP %d in %.1fs",
+                             url, error.code, delay)
+            except (HTTPException, socket.error) as error:
+                # Only reads are safe to repeat after a network error, since
+                # the server may already have applied a write.
+                delay = None
+                if method == "GET":
+                    delay = self.rate_limiter.retry_delay(attempt)
+                if delay is None:
+                    self._report_wait(method, url, waited)
+                    raise
+                logging.info("Retrying %s after %r in %.1fs",
+                             url, error, delay)
+            time.sleep(delay)
+            waited += delay
+            attempt += 1
+        self._report_wait(method, url, waited)
+        return response
+
+    def _report_wait(self, method, url, waited):
+        if waited:
+            logging.debug("%s %s waited %.2fs", method, url, waited)
+        if self.rate_limiter.on_wait:
+            self.rate_limiter.on_wait(method, url, waited)
+
+    def _json_request(self, path, post_data=None, **args):
+        """Returns the method, URL, body and headers of an API request."""
+        method = "GET"
+        request_data = None
+        headers = self._headers()
+        headers["Accept-Encoding"] = ContentDecoder.ACCEPT_ENCODING
+        if post_data:
+            post_data = dict((k, v) for k, v in post_data.items()
+                             if v or isinstance(v, int))
+            method = "POST"
+            request_data = urlencode(self._clean(**post_data))
+            if PY3:
+                request_data = request_data.encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        return method, self._url(path, **args), request_data, headers
+
+    def _headers(self):
+        headers = {}
+        if self.access_token:
+            headers["Authorization"] = "Bearer " + self.access_token
+        return headers
+
     def _clean(self, **args):
         return dict((k, str(v) if isinstance(v, int) else v.encode("utf-8"))
                     for k, v in args.items() if v or isinstance(v, int))
@@ -817,3 +3098,154 @@ class QuipClient(object):
         if args:
             url += "?" + urlencode(args)
         return url
+
+
+class EditResult(object):
+    """The outcome of an operation buffered by an `EditBuffer`."""
+    def __init__(self, buffer):
+        self.done = False
+        self.response = None
+        self.error = None
+        self._buffer = buffer
+
+    def result(self):
+        """Returns the response of the request that carried the operation,
+        flushing the buffer first if the operation is still pending, or
+        raises the error that request failed with."""
+        if not self.done:
+            self._buffer.flush()
+        if self.error:
+            raise self.error
+        return self.response
+
+    def _set(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.done = True
+
+
+class EditBuffer(object):
+    """Buffers `edit_document` operations on one thread and sends them in as
+    few requests as possible.
+
+    Consecutive APPEND operations are merged into one request, as are
+    consecutive PREPEND operations and consecutive BEFORE_SECTION or
+    AFTER_SECTION operations on the same section, if they have the same
+    format and arguments. A merged request leaves the document as sending
+    the operations one by one would have, so content prepended or inserted
+    after the same section is joined in reverse. Other operations are sent
+    as they are, in order.
+
+    Pending operations are sent by `flush`: when `max_operations` are
+    pending or their content exceeds `max_bytes`, when `max_delay` seconds
+    have passed since the first, and on `close` or at the end of a `with`
+    block. Each operation returns an `EditResult`.
+
+        client = quip.QuipClient(...)
+        with client.edit_buffer(thread_id) as edits:
+            for item in items:
+                edits.edit_document("<p>%s</p>" % item)
+    """
+    _MERGED_OPERATIONS = (
+        QuipClient.APPEND, QuipClient.PREPEND, QuipClient.AFTER_SECTION,
+        QuipClient.BEFORE_SECTION)
+    _REVERSED_OPERATIONS = (QuipClient.PREPEND, QuipClient.AFTER_SECTION)
+    _SEPARATORS = {"markdown": "\n\n"}
+
+    def __init__(self, client, thread_id, max_operations=100,
+                 max_bytes=512 * 1024, max_delay=None):
+        self.client = client
+        self.thread_id = thread_id
+        self.max_operations = max_operations
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._lock = threading.RLock()
+        self._pending = []
+        self._operations = 0
+        self._bytes = 0
+        self._timer = None
+
+    def edit_document(self, content, operation=QuipClient.APPEND,
+                      format="html", section_id=None, **kwargs):
+        """Buffers an edit of the thread, taking the arguments of
+        `QuipClient.edit_document`, and returns its `EditResult`."""
+        with self._lock:
+            result = EditResult(self)
+            if self._add(content, operation, format, section_id, kwargs,
+                         result):
+                self.flush()
+            elif self.max_delay is not None and self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+            return result
+
+    def flush(self):
+        """Sends the pending operations, and returns their responses in the
+        order they were buffered. If a request fails, its operations and
+        the ones after it fail with its error, which is raised."""
+        with self._lock:
+            requests = self._take()
+            responses = []
+            for i, (args, results) in enumerate(requests):
+                try:
+                    response = self.client.edit_document(**args)
+                except Exception as error:
+                    for _, later in requests[i:]:
+                        for result in later:
+                            result._set(error=error)
+                    raise
+                for result in results:
+                    result._set(response)
+                responses.extend([response] * len(results))
+            return responses
+
+    def close(self):
+        self.flush()
+
+    def _add(self, content, operation, format, section_id, kwargs, result):
+        """Adds an operation to the pending requests, and returns whether a
+        size threshold has been reached."""
+        args = dict(kwargs, thread_id=self.thread_id, content=content,
+                    operation=operation, format=format, section_id=section_id)
+        last = self._pending[-1][0] if self._pending else None
+        if (last and operation in self._MERGED_OPERATIONS and
+                type(content) == type(last["content"]) and
+                dict(last, content=None) == dict(args, content=None)):
+            separator = self._SEPARATORS.get(format, "")
+            if isinstance(content, bytes):
+                separator = separator.encode()
+            if operation in self._REVERSED_OPERATIONS:
+                last["content"] = content + separator + last["content"]
+            else:
+                last["content"] = last["content"] + separator + content
+            self._pending[-1][1].append(result)
+        else:
+            self._pending.append((args, [result]))
+        self._operations += 1
+        self._bytes += len(content)
+        return (self._operations >= self.max_operations or
+                self._bytes >= self.max_bytes)
+
+    def _take(self):
+        """Returns the pending requests and clears them."""
+        requests = self._pending
+        self._pending = []
+        self._operations = self._bytes = 0
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        return requests
+
+    def _expire(self):
+        try:
+            self.flush()
+        except Exception as error:
+            logging.warning("Buffered edits of %s failed: %s",
+                            self.thread_id, error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
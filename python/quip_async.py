@@ -0,0 +1,1115 @@
+# Copyright 2014 Quip
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""An asyncio client library for the Quip API. Requires Python 3.6+.
+
+For full API documentation, visit https://quip.com/api/.
+
+Typical usage:
+
+    client = quip_async.AsyncQuipClient(access_token=...)
+    user = await client.get_authenticated_user()
+    starred = await client.get_folder(user["starred_folder_id"])
+    print("There are", len(starred["children"]), "items in your starred folder")
+
+`AsyncQuipClient` has the same methods as `quip.QuipClient`. Every method
+that talks to the API is a coroutine; the parsing helpers, such as
+`parse_document_html` or `get_row_ids`, are plain methods as before, and
+the `iter_*` methods are asynchronous generators:
+
+    async for threads in client.iter_threads(thread_ids):
+        ...
+"""
+
+import asyncio
+import collections
+import copy
+import email.parser
+import http.client
+import io
+import json
+import logging
+import re
+import ssl
+import time
+import urllib.parse
+
+import quip
+
+
+class AsyncConnectionPool(object):
+    """A pool of persistent HTTP(S) connections for asyncio.
+
+    The asyncio counterpart of `quip.ConnectionPool`: connections are kept
+    alive and reused, at most `max_connections_per_host` are open to a host
+    at a time, and connections idle for longer than `idle_timeout` seconds
+    are closed. Waiting for a connection never blocks the event loop.
+
+    A pool must only be used from one event loop.
+    """
+    _IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+    def __init__(self, max_connections_per_host=100, idle_timeout=60,
+                 ssl_context=None, max_redirects=5):
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.ssl_context = ssl_context
+        self.max_redirects = max_redirects
+        # (scheme, host, port) -> [(connection, time returned to the pool)]
+        self._idle = {}
+        # (scheme, host, port) -> number of idle and checked out connections
+        self._open = {}
+        # (scheme, host, port) -> futures of coroutines waiting for a slot
+        self._waiters = {}
+
+    async def request(self, method, url, body=None, headers=None,
+                      timeout=None):
+        """Sends a request and returns an `AsyncResponse`.
+
+        Redirects are followed. Raises `HTTPError` if the final response does
+        not have a 2xx status.
+        """
+        headers = dict(headers or {})
+        for _ in range(self.max_redirects + 1):
+            response = await self._request_once(
+                method, url, body, headers, timeout)
+            location = response.getheader("Location")
+            if response.status not in quip.ConnectionPool._REDIRECT_CODES or \
+                    not location:
+                break
+            await response.read()
+            location = urllib.parse.urljoin(url, location)
+            if urllib.parse.urlsplit(location).netloc != \
+                    urllib.parse.urlsplit(url).netloc:
+                headers.pop("Authorization", None)
+            if response.status == 303 or (
+                    response.status in (301, 302) and method == "POST"):
+                method, body = "GET", None
+                headers.pop("Content-Type", None)
+                headers.pop("Content-Length", None)
+            url = location
+        if not 200 <= response.status < 300:
+            raise quip.HTTPError(
+                url, response.status, response.reason, response.msg,
+                io.BytesIO(await _read_decoded(response)))
+        return response
+
+    def close(self):
+        """Closes all idle connections in the pool."""
+        for key, idle in self._idle.items():
+            for connection, _ in idle:
+                connection.close()
+            self._open[key] -= len(idle)
+            del idle[:]
+
+    async def _request_once(self, method, url, body, headers, timeout):
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request = self._encode_request(
+            method, parts.netloc.rpartition("@")[2], path, body, headers)
+        connection, reused = await self._checkout(key, timeout)
+        try:
+            try:
+                head = await connection.send(request, body, timeout)
+            except asyncio.TimeoutError:
+                raise
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                # The server may have closed the kept-alive connection while
+                # it sat in the pool; try once more on a fresh connection.
+                # Only reads are safe to repeat, since the server may already
+                # have applied a write before the connection dropped.
+                if not reused or method not in self._IDEMPOTENT_METHODS:
+                    raise
+                connection.close()
+                connection = await self._connect(key, timeout)
+                head = await connection.send(request, body, timeout)
+        except BaseException:
+            self._release(key, connection, reusable=False)
+            raise
+        return AsyncResponse(self, key, connection, method, url, timeout, *head)
+
+    def _encode_request(self, method, host, path, body, headers):
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: " + host]
+        if body is not None:
+            lines.append("Content-Length: %d" % len(body))
+        lines.extend("%s: %s" % item for item in headers.items()
+                     if item[0].lower() not in ("host", "content-length"))
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        if isinstance(body, bytes):
+            return request + body
+        return request
+
+    async def _checkout(self, key, timeout):
+        while True:
+            self._evict_idle()
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()[0], True
+            if self._open.get(key, 0) < self.max_connections_per_host:
+                self._open[key] = self._open.get(key, 0) + 1
+                break
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.setdefault(key, collections.deque()).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wakeup we received but can no longer use.
+                if waiter.done() and not waiter.cancelled():
+                    self._wake(key)
+                raise
+        try:
+            return await self._connect(key, timeout), False
+        except BaseException:
+            self._release(key, None, reusable=False)
+            raise
+
+    async def _connect(self, key, timeout):
+        scheme, host, port = key
+        context = None
+        if scheme == "https":
+            context = self.ssl_context or ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), timeout)
+        return _Connection(reader, writer)
+
+    def _release(self, key, connection, reusable):
+        if reusable and not connection.closed():
+            self._idle.setdefault(key, []).append((connection, time.time()))
+        else:
+            if connection:
+                connection.close()
+            self._open[key] -= 1
+        self._wake(key)
+
+    def _wake(self, key):
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _evict_idle(self):
+        # Idle lists are ordered by return time, so stale connections are
+        # always at the front.
+        now = time.time()
+        for key, idle in self._idle.items():
+            while idle and (now - idle[0][1] > self.idle_timeout or
+                            idle[0][0].closed()):
+                connection, _ = idle.pop(0)
+                connection.close()
+                self._open[key] -= 1
+                self._wake(key)
+
+
+class _Connection(object):
+    """One HTTP/1.1 connection: an asyncio stream reader and writer."""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, request, body, timeout):
+        """Writes the request and returns the response status, reason and
+        headers.
+
+        `request` is the encoded request, including `body` if that is a byte
+        string; file-like bodies such as `quip.MultipartBody` are streamed
+        after it.
+        """
+        self.writer.write(request)
+        await asyncio.wait_for(self.writer.drain(), timeout)
+        if hasattr(body, "read"):
+            body.seek(0)
+            while True:
+                chunk = body.read(64 * 1024)
+                if not chunk:
+                    break
+                self.writer.write(chunk)
+                await asyncio.wait_for(self.writer.drain(), timeout)
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), timeout)
+            if not line:
+                raise ConnectionResetError("Connection closed by server")
+            version, status, reason = (
+                line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""])[:3]
+            header_lines = []
+            while True:
+                line = await asyncio.wait_for(self.reader.readline(), timeout)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                header_lines.append(line.decode("latin-1"))
+            # Skip interim responses such as "100 Continue"
+            if not 100 <= int(status) < 200:
+                break
+        msg = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(
+            "".join(header_lines))
+        return version, int(status), reason, msg
+
+    def closed(self):
+        # StreamWriter.is_closing only exists since Python 3.7.
+        return self.writer.transport.is_closing() or self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncResponse(object):
+    """An HTTP response whose body is read with `await response.read()`.
+
+    The connection goes back to its `AsyncConnectionPool` once the body has
+    been read to the end, or is closed if `close` is called before then.
+    """
+    def __init__(self, pool, key, connection, method, url, timeout,
+                 version, status, reason, msg):
+        self.status = self.code = status
+        self.reason = reason
+        self.msg = self.headers = msg
+        self.url = url
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._timeout = timeout
+        connection_header = (msg.get("Connection") or "").lower()
+        self._will_close = "close" in connection_header or (
+            version == "HTTP/1.0" and "keep-alive" not in connection_header)
+        self._chunked = False
+        self._remaining = None
+        if method == "HEAD" or status in (204, 304):
+            self._remaining = 0
+        elif "chunked" in (msg.get("Transfer-Encoding") or "").lower():
+            self._chunked = True
+            self._remaining = 0
+        elif msg.get("Content-Length") is not None:
+            self._remaining = int(msg.get("Content-Length"))
+        else:
+            # No framing; the body ends when the server closes.
+            self._will_close = True
+        if self._remaining == 0 and not self._chunked:
+            self._finish()
+
+    async def read(self, amt=None):
+        if amt is not None:
+            return await self._read_some(amt)
+        chunks = []
+        while True:
+            data = await self._read_some(64 * 1024)
+            if not data:
+                return b"".join(chunks)
+            chunks.append(data)
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name, default)
+
+    def info(self):
+        return self.msg
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def close(self):
+        if self._connection is not None:
+            self._finish(reusable=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def _read_some(self, amt):
+        if self._connection is None:
+            return b""
+        reader = self._connection.reader
+        try:
+            if self._chunked and self._remaining == 0:
+                line = await asyncio.wait_for(reader.readline(), self._timeout)
+                self._remaining = int(line.split(b";")[0].strip(), 16)
+                if self._remaining == 0:
+                    while await asyncio.wait_for(
+                            reader.readline(), self._timeout) not in (
+                                b"\r\n", b"\n", b""):
+                        pass
+                    self._finish()
+                    return b""
+            if self._remaining is None:
+                data = await asyncio.wait_for(reader.read(amt), self._timeout)
+                if not data:
+                    self._finish(reusable=False)
+                return data
+            data = await asyncio.wait_for(
+                reader.read(min(amt, self._remaining)), self._timeout)
+            if not data:
+                raise http.client.IncompleteRead(b"", self._remaining)
+            self._remaining -= len(data)
+            if self._remaining == 0:
+                if self._chunked:
+                    await asyncio.wait_for(
+                        reader.readexactly(2), self._timeout)
+                else:
+                    self._finish()
+            return data
+        except BaseException:
+            self.close()
+            raise
+
+    def _finish(self, reusable=True):
+        self._pool._release(
+            self._key, self._connection, reusable and not self._will_close)
+        self._connection = None
+
+
+async def _read_decoded(response, chunk_size=64 * 1024):
+    """Reads the whole body of the given response, decompressing it as it
+    arrives."""
+    decoder = quip.ContentDecoder(response.getheader("Content-Encoding"))
+    if decoder.encoding == "identity":
+        return await response.read()
+    chunks = []
+    while True:
+        chunk = await response.read(chunk_size)
+        if not chunk:
+            break
+        chunks.append(decoder.decode(chunk))
+    chunks.append(decoder.flush())
+    return b"".join(chunks)
+
+
+def _quip_error(error):
+    """Returns the `QuipError` described by the body of an `HTTPError`, or
+    the `HTTPError` itself if the body has no developer-friendly message."""
+    try:
+        message = json.loads(error.read().decode())["error_description"]
+    except Exception:
+        return error
+    return quip.QuipError(error.code, message, error)
+
+
+class AsyncQuipClient(quip.QuipClient):
+    """An asyncio Quip API client.
+
+    At most `max_concurrency` requests are in flight at a time; further
+    requests wait their turn without blocking the event loop.
+    """
+    def __init__(self, access_token=None, client_id=None, client_secret=None,
+                 base_url=None, request_timeout=None, connection_pool=None,
+                 rate_limiter=None, batch_size=100, max_workers=8,
+                 coalesce_reads=True, cache=None, thread_store=None,
+                 json_decoder=None, max_concurrency=100):
+        """Constructs an asyncio Quip API client.
+
+        Takes the same arguments as `QuipClient`, except that
+        `connection_pool` must be an `AsyncConnectionPool`. A `RateLimiter`
+        may be shared with synchronous clients. There is no thread pool, so
+        `max_workers` has no effect: batches of bulk getters are limited only
+        by `max_concurrency`. With `coalesce_reads`, a GET request made while
+        an identical one is in flight waits for it and shares its result.
+        """
+        quip.QuipClient.__init__(
+            self, access_token=access_token, client_id=client_id,
+            client_secret=client_secret, base_url=base_url,
+            request_timeout=request_timeout,
+            connection_pool=connection_pool if connection_pool else
+                AsyncConnectionPool(max_connections_per_host=max_concurrency),
+            rate_limiter=rate_limiter, batch_size=batch_size,
+            max_workers=max_workers, coalesce_reads=coalesce_reads,
+            cache=cache, thread_store=thread_store, json_decoder=json_decoder)
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        # The task of each GET request in flight, and how many other callers
+        # wait for it, by URL
+        self._in_flight = {} if coalesce_reads else None
+
+    async def close(self):
+        """Closes the idle connections of the client's pool."""
+        self.connection_pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def edit_buffer(self, thread_id, **kwargs):
+        """Returns an `AsyncEditBuffer` that merges consecutive edits of the
+        given thread into as few `edit_document` requests as possible."""
+        return AsyncEditBuffer(self, thread_id, **kwargs)
+
+    def user_directory(self, **kwargs):
+        """Returns an `AsyncUserDirectory` that looks up users in batches and
+        remembers them."""
+        return AsyncUserDirectory(self, **kwargs)
+
+    async def get_threads_cached(self, versions):
+        """Returns a dictionary of threads for the given dictionary of thread
+        IDs to `updated_usec`. See `QuipClient.get_threads_cached`.
+        """
+        threads = {}
+        changed = []
+        for id, updated_usec in dict(versions).items():
+            thread = self.thread_store.get_thread(id, updated_usec)
+            if thread is None:
+                changed.append(id)
+            else:
+                threads[id] = thread
+        if changed:
+            threads.update(await self.get_threads(changed))
+        return threads
+
+    async def get_messages_cached(self, thread_id, updated_usec,
+                                  max_created_usec=None, count=None):
+        """Like `get_messages`, but reads and stores the messages in the
+        client's `thread_store`. See `QuipClient.get_messages_cached`."""
+        messages = self.thread_store.get_messages(
+            thread_id, updated_usec, max_created_usec, count)
+        if messages is None:
+            messages = await self.get_messages(
+                thread_id, max_created_usec, count)
+            self.thread_store.put_messages(
+                thread_id, updated_usec, messages, max_created_usec, count)
+        return messages
+
+    async def walk_folders(self, root_ids):
+        """Walks the folder trees under the given folders breadth-first,
+        yielding `(path, folder, threads)` for each folder. See
+        `QuipClient.walk_folders`."""
+        seen = set()
+        paths = []
+        for id in root_ids:
+            if id not in seen:
+                seen.add(id)
+                paths.append((id,))
+        while paths:
+            folders = {}
+            async for batch in self._iter_batched(
+                    "folders/", [p[-1] for p in paths], isolate_errors=True):
+                folders.update(batch)
+            level = quip._FolderLevel(paths, folders, seen)
+            for record in level.ready():
+                yield record
+            if level.thread_ids:
+                async for batch in self._iter_batched(
+                        "threads/", level.thread_ids, isolate_errors=True):
+                    for record in level.add_threads(batch):
+                        yield record
+            for record in level.rest():
+                yield record
+            paths = level.next_paths
+
+    async def move_thread(self, thread_id, source_folder_id,
+                          destination_folder_id):
+        """Moves the given thread from the source folder to the destination one.
+        """
+        await self.add_thread_members(thread_id, [destination_folder_id])
+        await self.remove_thread_members(thread_id, [source_folder_id])
+
+    async def merge_comments(self, original_id, children_ids,
+                             ignore_user_ids=[]):
+        """Given an original document and a set of exact duplicates, copies
+        all comments and messages on the duplicates to the original.
+
+        Impersonates the commentors if the access token used has
+        permission, but does not add them to the thread.
+        """
+        threads = await self.get_threads(children_ids + [original_id])
+        original_section_ids = re.findall(r" id='([a-zA-Z0-9]{11})'",
+                                          threads[original_id]["html"])
+        for thread_id in children_ids:
+            thread = threads[thread_id]
+            child_section_ids = re.findall(r" id='([a-zA-Z0-9]{11})'",
+                                           thread["html"])
+            parent_map = dict(zip(child_section_ids, original_section_ids))
+            messages = await self.get_messages(thread_id)
+            for message in reversed(messages):
+                if message["author_id"] in ignore_user_ids:
+                    continue
+                kwargs = {
+                    "user_id": message["author_id"],
+                    "frame": "bubble",
+                    "service_id": message["id"],
+                }
+                if "parts" in message:
+                    kwargs["parts"] = json.dumps(message["parts"])
+                else:
+                    kwargs["content"] = message["text"]
+                if "annotation" in message:
+                    section_id = None
+                    if "highlight_section_ids" in message["annotation"]:
+                        section_id = message["annotation"][
+                            "highlight_section_ids"][0]
+                    else:
+                        anno_loc = thread["html"].find(
+                            '<annotation id="%s"' % message["annotation"]["id"])
+                        loc = thread["html"].rfind("id=", 0, anno_loc)
+                        if anno_loc >= 0 and loc >= 0:
+                            section_id = thread["html"][loc + 4:loc + 15]
+                    if section_id and section_id in parent_map:
+                        kwargs["section_id"] = parent_map[section_id]
+                if "files" in message:
+                    # Copy the attachments concurrently.
+                    async def copy_blob(blob_info):
+                        blob = await self.get_blob(thread_id, blob_info["hash"])
+                        new_blob = await self.put_blob(
+                            original_id, await blob.read(),
+                            name=blob_info["name"])
+                        return new_blob["id"]
+                    attachments = await asyncio.gather(
+                        *[copy_blob(blob_info)
+                          for blob_info in message["files"]])
+                    if attachments:
+                        kwargs["attachments"] = ",".join(attachments)
+                await self.new_message(original_id, **kwargs)
+
+    async def add_to_first_list(self, thread_id, *items, **kwargs):
+        """Adds the given items to the first list in the given document. Pass
+        a `DocumentSnapshot` or the document's HTML as `document_html` to
+        avoid fetching it again.
+
+            client = quip_async.AsyncQuipClient(...)
+            await client.add_to_first_list(thread_id, "Try the Quip API")
+
+        """
+        items = [item.replace("\n", " ") for item in items]
+        args = {
+            "thread_id": thread_id,
+            "content": "\n\n".join(items),
+            "format": "markdown",
+            "operation": self.AFTER_SECTION
+        }
+        args.update(kwargs)
+        document_html = args.pop("document_html", None)
+        if "section_id" not in args:
+            first_list = await self.get_first_list(thread_id, document_html)
+            if first_list:
+                args["section_id"] = self.get_last_list_item_id(first_list)
+        if not args.get("section_id"):
+            args["operation"] = self.APPEND
+            args["content"] = "\n\n".join(["    * %s" % i for i in items])
+        response = await self.edit_document(**args)
+        self._refresh_snapshot(document_html, response)
+        return response
+
+    async def add_to_spreadsheet(self, thread_id, *rows, **kwargs):
+        """Adds the given rows to the named (or first) spreadsheet in the
+        given document. Pass a `DocumentSnapshot` or the document's HTML as
+        `document_html` to avoid fetching it again.
+
+            client = quip_async.AsyncQuipClient(...)
+            await client.add_to_spreadsheet(thread_id, ["5/1/2014", 2.24])
+
+        """
+        content = "".join(["<tr>%s</tr>" % "".join(
+            ["<td>%s</td>" % cell for cell in row]) for row in rows])
+        document_html = kwargs.get("document_html")
+        if kwargs.get("name"):
+            spreadsheet = await self.get_named_spreadsheet(
+                kwargs["name"], thread_id, document_html)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(
+                thread_id, document_html)
+        if kwargs.get("add_to_top"):
+            section_id = self.get_first_row_item_id(spreadsheet)
+            operation = self.BEFORE_SECTION
+        else:
+            section_id = self.get_last_row_item_id(spreadsheet)
+            operation = self.AFTER_SECTION
+        response = await self.edit_document(
+            thread_id=thread_id,
+            content=content,
+            section_id=section_id,
+            operation=operation)
+        self._refresh_snapshot(document_html, response)
+        return response
+
+    async def update_spreadsheet_row(self, thread_id, header, value, updates,
+                                     **args):
+        """Finds the row where the given header column is the given value, and
+        applies the given updates. See `QuipClient.update_spreadsheet_row`.
+        """
+        response = None
+        document_html = args.pop("document_html", None)
+        if args.get("name"):
+            spreadsheet = await self.get_named_spreadsheet(
+                args["name"], thread_id, document_html)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(
+                thread_id, document_html)
+        index = self.get_spreadsheet_index(spreadsheet, document_html)
+        headers = index.headers
+        row = index.find(header, value)
+        if row is not None:
+            ids = self.get_row_ids(row)
+            for head, val in updates.items():
+                column = self.get_index_of_header(headers, head)
+                if not column or column >= len(ids) or not ids[column]:
+                    continue
+                response = await self.edit_document(
+                    thread_id=thread_id,
+                    content=val,
+                    format="markdown",
+                    section_id=ids[column],
+                    operation=self.REPLACE_SECTION,
+                    **args)
+                index.set_cell(row, column, val)
+        else:
+            updates[header] = value
+            response = await self.add_spreadsheet_row(
+                thread_id, spreadsheet, updates, headers=headers, **args)
+            self._refresh_snapshot(document_html, response)
+        return response
+
+    async def add_spreadsheet_row(
+            self, thread_id, spreadsheet, updates, headers=None, **args):
+        # Building the row needs no I/O, so the synchronous client does it;
+        # only the edit it ends with is awaited.
+        return await quip.QuipClient.add_spreadsheet_row(
+            self, thread_id, spreadsheet, updates, headers=headers, **args)
+
+    async def upsert_spreadsheet_rows(self, thread_id, key_header, rows,
+                                      name=None):
+        """Applies many row updates to the named (or first) spreadsheet in the
+        given document at once. See `QuipClient.upsert_spreadsheet_rows`."""
+        if name:
+            spreadsheet = await self.get_named_spreadsheet(name, thread_id)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(thread_id)
+        responses = []
+        for edit in self._spreadsheet_sync_edits(
+                spreadsheet, key_header, rows, delete_missing=False):
+            responses.append(
+                await self.edit_document(thread_id=thread_id, **edit))
+        return responses
+
+    async def sync_spreadsheet(self, thread_id, key_header, rows, name=None,
+                               delete_missing=True):
+        """Makes the named (or first) spreadsheet in the given document hold
+        the given rows, with as few edits as possible. See
+        `QuipClient.sync_spreadsheet`."""
+        if name:
+            spreadsheet = await self.get_named_spreadsheet(name, thread_id)
+        else:
+            spreadsheet = await self.get_first_spreadsheet(thread_id)
+        responses = []
+        for edit in self._spreadsheet_sync_edits(
+                spreadsheet, key_header, rows, delete_missing):
+            responses.append(
+                await self.edit_document(thread_id=thread_id, **edit))
+        return responses
+
+    async def get_section(self, section_id, thread_id=None,
+                          document_html=None):
+        if not document_html:
+            document_html = (await self.get_thread(thread_id)).get("html")
+            if not document_html:
+                return None
+        return quip.QuipClient.get_section(
+            self, section_id, document_html=document_html)
+
+    async def get_named_spreadsheet(self, name, thread_id=None,
+                                    document_html=None):
+        if not document_html:
+            document_html = (await self.get_thread(thread_id)).get("html")
+            if not document_html:
+                return None
+        return quip.QuipClient.get_named_spreadsheet(
+            self, name, document_html=document_html)
+
+    async def snapshot(self, thread_id=None, thread=None):
+        """Returns a `quip.DocumentSnapshot` of the given thread's document.
+        See `QuipClient.snapshot`."""
+        if thread is None:
+            thread = await self.get_thread(thread_id)
+        return quip.QuipClient.snapshot(self, thread=thread)
+
+    async def _get_container(self, thread_id, document_html, container, index):
+        if not document_html:
+            document_html = (await self.get_thread(thread_id)).get("html")
+            if not document_html:
+                return None
+        return quip.QuipClient._get_container(
+            self, None, document_html, container, index)
+
+    async def get_blob(self, thread_id, blob_id):
+        """Returns an `AsyncResponse` with the contents of the given blob from
+        the given thread; read it with `await response.read()`.
+        """
+        try:
+            return await self._request(
+                "GET", self._url("blob/%s/%s" % (thread_id, blob_id)),
+                headers=self._headers())
+        except quip.HTTPError as error:
+            raise _quip_error(error)
+
+    async def download_blob(self, thread_id, blob_id, dest,
+                            chunk_size=64 * 1024, resume=False):
+        """Downloads the given blob from the given thread to `dest` and
+        returns the response headers. See `QuipClient.download_blob`.
+        """
+        write, rewind, offset, close = self._blob_destination(dest, resume)
+        url = self._url("blob/%s/%s" % (thread_id, blob_id))
+        info = None
+        attempt = 0
+        try:
+            while True:
+                headers = self._headers()
+                if offset:
+                    headers["Range"] = "bytes=%d-" % offset
+                try:
+                    response = await self._request("GET", url, headers=headers)
+                except quip.HTTPError as error:
+                    if error.code == 416 and offset:
+                        # We already have the whole blob, unless the server
+                        # says it is shorter than our file.
+                        self._check_blob_tail(quip._content_range_total(
+                            error.hdrs.get("Content-Range")), offset, blob_id)
+                        info = await self._blob_tail_info(
+                            url, offset, blob_id) or error.hdrs
+                        break
+                    raise _quip_error(error)
+                info = info or response.info()
+                if offset and response.status != 206:
+                    # The server ignored the range, so start over.
+                    if rewind is None:
+                        response.close()
+                        raise IOError("Cannot restart the download of blob "
+                                      "%s on an unseekable file" % blob_id)
+                    rewind()
+                    offset = 0
+                total = self._blob_length(response, offset)
+                error = None
+                try:
+                    while True:
+                        data = await response.read(chunk_size)
+                        if not data:
+                            break
+                        write(data)
+                        offset += len(data)
+                except (http.client.HTTPException, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError, OSError) as e:
+                    response.close()
+                    error = e
+                if not error and (total is None or offset == total):
+                    break
+                delay = None
+                if total is None or offset < total:
+                    delay = self.rate_limiter.retry_delay(attempt)
+                if delay is None:
+                    if error:
+                        raise error
+                    raise IOError("Received %d of %d bytes of blob %s" % (
+                        offset, total, blob_id))
+                logging.info("Resuming %s at byte %d after %r",
+                             url, offset, error or "a short read")
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            if close:
+                close.close()
+        return info
+
+    async def _blob_tail_info(self, url, offset, blob_id):
+        headers = self._headers()
+        headers["Range"] = "bytes=%d-%d" % (offset - 1, offset - 1)
+        try:
+            response = await self._request("GET", url, headers=headers)
+        except quip.HTTPError:
+            return None
+        await response.read()
+        self._check_blob_tail(
+            self._blob_length(response, offset - 1), offset, blob_id)
+        return response.info()
+
+    async def put_blob(self, thread_id, blob, name=None, progress=None):
+        """Uploads an image or other blob to the given Quip thread. Returns an
+        ID that can be used to add the image to the document of the thread.
+
+        Accepts the same blobs as `QuipClient.put_blob`, and streams them the
+        same way.
+        """
+        body, headers = self._blob_upload_body(blob, name, progress)
+        try:
+            response = await self._request(
+                "POST", self._url("blob/" + thread_id), body=body,
+                headers=headers)
+            return self.json_decoder(await response.read())
+        except quip.HTTPError as error:
+            raise _quip_error(error)
+
+    async def put_blobs(self, thread_id, blobs, progress=None):
+        """Uploads the given blobs to the given thread concurrently and
+        returns their responses in order. See `QuipClient.put_blobs`.
+        """
+        async def upload(index, blob):
+            name = None
+            if isinstance(blob, tuple):
+                name, blob = blob
+            return await self.put_blob(
+                thread_id, blob, name=name, progress=progress and (
+                    lambda sent, total: progress(index, sent, total)))
+        return await asyncio.gather(
+            *[upload(index, blob) for index, blob in enumerate(blobs)])
+
+    async def _fetch_json(self, path, post_data=None, **args):
+        result = self._cached_response(path, post_data, args)
+        if result is not None:
+            return result
+        method, url, body, headers = self._json_request(
+            path, post_data, **args)
+        try:
+            if method == "GET" and self._in_flight is not None:
+                result = await self._coalesced(
+                    url, lambda: self._send_json(method, url, body, headers))
+            else:
+                result = await self._send_json(method, url, body, headers)
+        except quip.HTTPError as error:
+            raise _quip_error(error)
+        finally:
+            # A failed write may still have been applied.
+            self._invalidate_written(path, post_data)
+        self._cache_response(path, post_data, args, result)
+        return result
+
+    async def _send_json(self, method, url, body, headers):
+        response = await self._request(method, url, body=body, headers=headers)
+        return self.json_decoder(await _read_decoded(response))
+
+    async def _coalesced(self, key, send):
+        """Returns the result of `send()`, or a copy of the result of the
+        identical request already in flight, like `quip._SingleFlight`."""
+        call = self._in_flight.get(key)
+        if call is None:
+            call = self._in_flight[key] = [asyncio.ensure_future(send()), 0]
+            call[0].add_done_callback(
+                lambda _: self._in_flight.pop(key, None))
+            # Shielded, so that cancelling the caller leaves the request to
+            # the others waiting for it.
+            result = await asyncio.shield(call[0])
+            # No more waiters can join now. They copy the result once they
+            # resume, so the caller must not get the original if there are any.
+            return copy.deepcopy(result) if call[1] else result
+        call[1] += 1
+        return copy.deepcopy(await asyncio.shield(call[0]))
+
+    async def _fetch_batched(self, path, ids):
+        results = {}
+        async for batch in self._iter_batched(path, ids):
+            results.update(batch)
+        return results
+
+    async def _iter_batched(self, path, ids, isolate_errors=False):
+        """Yields the results of `path` for `ids`, split into batches of at
+        most `batch_size` IDs that are all requested at once. Results are
+        yielded in the order they arrive. See `QuipClient._iter_batched` for
+        `isolate_errors`."""
+        ids = list(ids)
+        batches = [ids[i:i + self.batch_size]
+                   for i in range(0, len(ids), self.batch_size)] or [[]]
+        fetch = lambda batch: self._fetch_json(
+            path, post_data={"ids": ",".join(batch)})
+        if isolate_errors:
+            fetch = lambda batch: self._fetch_isolated(path, batch)
+        tasks = [asyncio.ensure_future(fetch(batch)) for batch in batches]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_isolated(self, path, ids):
+        try:
+            return await self._fetch_json(
+                path, post_data={"ids": ",".join(ids)})
+        except (quip.QuipError, quip.HTTPError) as error:
+            if len(ids) <= 1:
+                logging.warning("Skipped %s%s: %s", path, ",".join(ids), error)
+                return {}
+        results = await asyncio.gather(
+            *[self._fetch_isolated(path, [id]) for id in ids])
+        return dict(item for result in results for item in result.items())
+
+    async def _prefetch_pages(self, fetch, page, cursor):
+        """Yields the items of consecutive pages, fetching the next page in
+        a task while the caller consumes the current one. Makes
+        `iter_messages`, `iter_recent_threads` and `iter_matching_threads`
+        async generators."""
+        async def fetch_page(cursor):
+            return page(await fetch(cursor), cursor)
+
+        task = asyncio.ensure_future(fetch_page(cursor))
+        try:
+            while task:
+                items, cursor = await task
+                task = None
+                if cursor is not None:
+                    task = asyncio.ensure_future(fetch_page(cursor))
+                for item in items:
+                    yield item
+        finally:
+            if task:
+                task.cancel()
+
+    async def _request(self, method, url, body=None, headers=None):
+        """Sends a request through the connection pool, paced by the rate
+        limiter. Throttled and transient failures are retried."""
+        waited = 0.0
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                waited += delay
+            try:
+                async with self._concurrency():
+                    response = await self.connection_pool.request(
+                        method, url, body=body, headers=headers,
+                        timeout=self.request_timeout)
+                self.rate_limiter.update(response.msg)
+                break
+            except quip.HTTPError as error:
+                self.rate_limiter.update(error.hdrs)
+                delay = self.rate_limiter.retry_delay(
+                    attempt, error.code, error.hdrs, method)
+                if delay is None:
+                    self._report_wait(method, url, waited)
+                    raise
+                logging.info("Retrying %s after HTTP %d in %.1fs",
+                             url, error.code, delay)
+            except (http.client.HTTPException, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError, OSError) as error:
+                # Only reads are safe to repeat after a network error, since
+                # the server may already have applied a write.
+                delay = None
+                if method == "GET":
+                    delay = self.rate_limiter.retry_delay(attempt)
+                if delay is None:
+                    self._report_wait(method, url, waited)
+                    raise
+                logging.info("Retrying %s after %r in %.1fs",
+                             url, error, delay)
+            await asyncio.sleep(delay)
+            waited += delay
+            attempt += 1
+        self._report_wait(method, url, waited)
+        return response
+
+    def _concurrency(self):
+        # Created lazily so that it belongs to the loop the client runs on.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+
+class AsyncEditResult(quip.EditResult):
+    """The outcome of an operation buffered by an `AsyncEditBuffer`."""
+    async def result(self):
+        if not self.done:
+            await self._buffer.flush()
+        if self.error:
+            raise self.error
+        return self.response
+
+
+class AsyncEditBuffer(quip.EditBuffer):
+    """Like `quip.EditBuffer`, for an `AsyncQuipClient`. Its methods are
+    coroutines, and it is used with `async with`."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._flushing = None
+
+    async def edit_document(self, content, operation=quip.QuipClient.APPEND,
+                            format="html", section_id=None, **kwargs):
+        result = AsyncEditResult(self)
+        if self._add(content, operation, format, section_id, kwargs, result):
+            await self.flush()
+        elif self.max_delay is not None and self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(
+                self.max_delay,
+                lambda: asyncio.ensure_future(self._expire()))
+        return result
+
+    async def flush(self):
+        # Created lazily so that it belongs to the loop the buffer runs on.
+        if self._flushing is None:
+            self._flushing = asyncio.Lock()
+        # Requests taken by an earlier flush are sent first.
+        async with self._flushing:
+            requests = self._take()
+            responses = []
+            for i, (args, results) in enumerate(requests):
+                try:
+                    response = await self.client.edit_document(**args)
+                except Exception as error:
+                    for _, later in requests[i:]:
+                        for result in later:
+                            result._set(error=error)
+                    raise
+                for result in results:
+                    result._set(response)
+                responses.extend([response] * len(results))
+            return responses
+
+    async def close(self):
+        await self.flush()
+
+    async def _expire(self):
+        try:
+            await self.flush()
+        except Exception as error:
+            logging.warning("Buffered edits of %s failed: %s",
+                            self.thread_id, error)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncUserDirectory(quip.UserDirectory):
+    """Like `quip.UserDirectory`, for an `AsyncQuipClient`. Its methods are
+    coroutines."""
+    async def warm(self):
+        self._add(dict((user["id"], user)
+                       for user in await self.client.get_contacts()))
+
+    async def resolve(self, ids):
+        ids = list(ids)
+        unknown = self._unknown(ids)
+        if unknown:
+            self._add(await self._fetch(unknown), unknown)
+        return self._lookup(ids)
+
+    async def get(self, id):
+        return (await self.resolve([id]))[id]
+
+    async def _fetch(self, ids):
+        if len(ids) > 1:
+            try:
+                return await self.client.get_users(ids)
+            except (quip.QuipError, quip.HTTPError):
+                pass
+        users = {}
+        for id in ids:
+            try:
+                users[id] = await self.client.get_user(id)
+            except (quip.QuipError, quip.HTTPError):
+                pass
+        return users
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Quip
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests of the Quip API client against a local HTTP server.
+
+    python -m unittest discover python/tests
+"""
+
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import xml.etree.cElementTree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import quip
+
+try:
+    import http.server as http_server
+    import socketserver
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+
+try:
+    import asyncio
+    import quip_async
+except (ImportError, SyntaxError):
+    quip_async = None
+
+
+class _Server(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    daemon_threads = True
+
+
+class _BlobHandler(http_server.BaseHTTPRequestHandler):
+    """Serves `server.blob` at any path, honoring Range requests."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        blob = self.server.blob
+        self.server.ranges.append(self.headers.get("Range"))
+        start, end = 0, len(blob) - 1
+        if self.headers.get("Range"):
+            first, _, last = self.headers["Range"][6:].partition("-")
+            start = int(first)
+            end = int(last) if last else end
+            if start >= len(blob):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%d" % len(blob))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (start, end, len(blob)))
+        else:
+            self.send_response(200)
+        body = blob[start:end + 1]
+        self.send_header("Content-Disposition", 'attachment; filename="a.png"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadBlobTest(unittest.TestCase):
+    BLOB = b"0123456789" * 1000
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _BlobHandler)
+        self.server.blob = self.BLOB
+        self.server.ranges = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "blob")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def client(self):
+        client = quip.QuipClient(access_token="token", base_url=self.base_url)
+        self.addCleanup(client.connection_pool.close)
+        return client
+
+    def write_file(self, data):
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def read_file(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_download(self):
+        dest = io.BytesIO()
+        info = self.client().download_blob("thread", "blob", dest)
+        self.assertEqual(self.BLOB, dest.getvalue())
+        self.assertEqual('attachment; filename="a.png"',
+                         info.get("Content-Disposition"))
+
+    def test_resume_partial_file(self):
+        self.write_file(self.BLOB[:4000])
+        info = self.client().download_blob(
+            "thread", "blob", self.path, resume=True)
+        self.assertEqual(self.BLOB, self.read_file())
+        self.assertEqual(["bytes=4000-"], self.server.ranges)
+        self.assertIsNotNone(info.get("Content-Disposition"))
+
+    def test_resume_complete_file_returns_headers(self):
+        self.write_file(self.BLOB)
+        info = self.client().download_blob(
+            "thread", "blob", self.path, resume=True)
+        self.assertEqual(self.BLOB, self.read_file())
+        self.assertEqual('attachment; filename="a.png"',
+                         info.get("Content-Disposition"))
+        self.assertEqual(["bytes=%d-" % len(self.BLOB),
+                          "bytes=%d-%d" % (len(self.BLOB) - 1,
+                                           len(self.BLOB) - 1)],
+                         self.server.ranges)
+
+    def test_resume_longer_file_raises(self):
+        self.write_file(self.BLOB + b"extra")
+        self.assertRaises(IOError, self.client().download_blob,
+                          "thread", "blob", self.path, resume=True)
+
+    @unittest.skipIf(quip_async is None, "requires Python 3.6+")
+    def test_async_resume_complete_file_returns_headers(self):
+        self.write_file(self.BLOB)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        client = quip_async.AsyncQuipClient(
+            access_token="token", base_url=self.base_url)
+        try:
+            info = loop.run_until_complete(client.download_blob(
+                "thread", "blob", self.path, resume=True))
+        finally:
+            loop.run_until_complete(client.close())
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(self.BLOB, self.read_file())
+        self.assertEqual('attachment; filename="a.png"',
+                         info.get("Content-Disposition"))
+
+
+class PrefetchPagesTest(unittest.TestCase):
+    def test_close_stops_fetching(self):
+        fetched = []
+
+        def fetch(cursor):
+            time.sleep(0.05)
+            fetched.append(cursor)
+            return cursor
+
+        client = quip.QuipClient(access_token="token")
+        items = client._prefetch_pages(
+            fetch, lambda page, cursor: ([page] * 3, page + 1), 0)
+        self.assertEqual(0, next(items))
+        items.close()
+        count = len(fetched)
+        time.sleep(0.2)
+        self.assertEqual(count, len(fetched))
+        self.assertLessEqual(count, 3)
+
+
+class CellHtmlTest(unittest.TestCase):
+    def test_keeps_the_cell_id(self):
+        cell = xml.etree.cElementTree.fromstring(
+            '<td id="s:r1_c1" class="bold"><span>a</span></td>')
+        html = quip.QuipClient(access_token="token")._cell_html(cell)
+        self.assertEqual('<td class="bold"><span>a</span></td>', html)
+        self.assertEqual("s:r1_c1", cell.attrib["id"])
+
+
+class _EditRecorder(quip.QuipClient):
+    """Records `edit_document` calls instead of sending them."""
+    def __init__(self, html):
+        quip.QuipClient.__init__(self, access_token="token")
+        self.html = html
+        self.edits = []
+
+    def edit_document(self, **args):
+        self.edits.append(args)
+        return {"html": self.html}
+
+
+class AddToFirstListTest(unittest.TestCase):
+    HTML = ('<ul id="l1"><li id="i1">One</li><li id="i2">Two</li></ul>')
+
+    def test_snapshot(self):
+        client = _EditRecorder(self.HTML.replace(
+            "</ul>", '<li id="i3">Three</li></ul>'))
+        snapshot = client.snapshot(thread={"html": self.HTML})
+        client.add_to_first_list("thread", "Three", document_html=snapshot)
+        self.assertEqual([{
+            "thread_id": "thread", "content": "Three", "format": "markdown",
+            "operation": quip.QuipClient.AFTER_SECTION, "section_id": "i2",
+        }], client.edits)
+        self.assertEqual("i3", client.get_last_list_item_id(
+            client.get_first_list("thread", snapshot)))
+
+    def test_html(self):
+        client = _EditRecorder(self.HTML)
+        client.add_to_first_list("thread", "Three", document_html=self.HTML)
+        self.assertEqual("i2", client.edits[0]["section_id"])
+        self.assertNotIn("document_html", client.edits[0])
+
+
+class SpreadsheetSyncTest(unittest.TestCase):
+    HTML = (
+        '<table title="Sheet1"><thead><tr>'
+        '<th id="h0"></th><th id="h1">Name</th><th id="h2">Note</th>'
+        '</tr></thead><tbody>'
+        '<tr id="r1"><td id="r1c0">1</td><td id="r1c1">Acme</td>'
+        '<td id="r1c2"><b>Big</b> customer</td></tr>'
+        '<tr id="r2"><td id="r2c0">2</td><td id="r2c1">Acme</td>'
+        '<td id="r2c2">copy</td></tr>'
+        u'<tr id="r3"><td id="r3c0">3</td><td id="r3c1">\u200b</td>'
+        u'<td id="r3c2">\u200b</td></tr>'
+        '</tbody></table>')
+
+    def edits(self, rows, delete_missing=True):
+        client = quip.QuipClient(access_token="token")
+        spreadsheet = xml.etree.cElementTree.fromstring(
+            self.HTML.encode("utf-8"))
+        return client._spreadsheet_sync_edits(
+            spreadsheet, "Name", rows, delete_missing)
+
+    def test_unchanged_rich_text_cell(self):
+        self.assertEqual([], self.edits(
+            [{"Name": "Acme", "Note": "Big customer"}], delete_missing=False))
+
+    def test_changed_rich_text_cell(self):
+        edits = self.edits(
+            [{"Name": "Acme", "Note": "Big"}], delete_missing=False)
+        self.assertEqual(["r1"], [edit["section_id"] for edit in edits])
+
+    def test_duplicate_keys(self):
+        rows = [{"Name": "Acme", "Note": "Big customer"}]
+        self.assertEqual([], self.edits(rows, delete_missing=False))
+        self.assertEqual(
+            [("r2", quip.QuipClient.DELETE_SECTION)],
+            [(edit["section_id"], edit["operation"])
+             for edit in self.edits(rows)])
+
+    def test_empty_key(self):
+        self.assertRaises(ValueError, self.edits, [{"Name": "", "Note": "x"}])
+        self.assertRaises(
+            ValueError, self.edits, [{"Name": u"\u200b", "Note": "x"}])
+
+
+class _UserClient(object):
+    """Knows the users in `users`, and fails requests for others with a bare
+    HTTP error, as when the response has no error description."""
+    def __init__(self, users):
+        self.users = users
+
+    def get_user(self, id):
+        if id not in self.users:
+            raise quip.HTTPError(id, 404, "Not Found", {}, io.BytesIO())
+        return self.users[id]
+
+    def get_users(self, ids):
+        return dict((id, self.get_user(id)) for id in ids)
+
+
+class UserDirectoryTest(unittest.TestCase):
+    def test_http_error(self):
+        users = quip.UserDirectory(_UserClient({"u1": {"id": "u1"}}))
+        self.assertEqual({"u1": {"id": "u1"}, "u2": None},
+                         users.resolve(["u1", "u2"]))
+        self.assertIsNone(users.get("u3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,13 +20,18 @@ This is a sample app for the Quip API - https://quip.com/api/.
 """
 
 import argparse
+import contextlib
 import datetime
+import hashlib
+import json
 import logging
 import os.path
+import Queue
 import re
 import shutil
 import sys
-import urllib2
+import tempfile
+import threading
 import xml.etree.cElementTree
 import xml.sax.saxutils
 
@@ -40,7 +45,10 @@ _STATIC_DIRECTORY = os.path.abspath(os.path.join(_BASE_DIRECTORY, 'static'))
 _TEMPLATE_DIRECTORY = os.path.abspath(
     os.path.join(_BASE_DIRECTORY, 'templates'))
 _OUTPUT_STATIC_DIRECTORY_NAME = '_static'
+_OUTPUT_BLOB_DIRECTORY_NAME = '_blobs'
+_MANIFEST_FILE_NAME = 'manifest.json'
 _MAXIMUM_TITLE_LENGTH = 64
+_MESSAGE_PAGE_SIZE = 100
 
 def main():
     logging.getLogger().setLevel(logging.DEBUG)
@@ -57,178 +65,585 @@ def main():
              "https://platform.quip.com will be used")
     parser.add_argument("--output_directory", default="./",
         help="Directory where to place backup data.")
+    parser.add_argument("--incremental", action="store_true",
+        help="Update the backup already in the output directory, fetching "
+             "only the threads, messages and images that changed since it "
+             "was made, instead of starting over.")
+    parser.add_argument("--fetch_workers", type=int, default=4,
+        help="Number of threads whose messages are fetched at once.")
+    parser.add_argument("--blob_workers", type=int, default=8,
+        help="Number of threads whose images are downloaded at once.")
+    parser.add_argument("--write_workers", type=int, default=2,
+        help="Number of threads whose files are written at once.")
+    parser.add_argument("--queue_size", type=int, default=16,
+        help="Number of threads that may wait between two steps of the "
+             "backup, which bounds how much of it is held in memory.")
 
     args = parser.parse_args()
 
+    # Each worker gets its own connection, and the client's rate limiter
+    # keeps all of them within the API's rate limits.
+    workers = args.fetch_workers + args.blob_workers + args.write_workers
     client = quip.QuipClient(
         access_token=args.access_token, base_url=args.quip_api_base_url,
-        request_timeout=120)
+        request_timeout=120, connection_pool=quip.ConnectionPool(
+            max_connections_per_host=workers + 8))
     output_directory = os.path.join(
         _normalize_path(args.output_directory), "baqup")
     _ensure_path_exists(output_directory)
-    shutil.rmtree(output_directory, ignore_errors=True)
+    if not args.incremental:
+        shutil.rmtree(output_directory, ignore_errors=True)
     output_static_diretory = os.path.join(
         output_directory, _OUTPUT_STATIC_DIRECTORY_NAME)
+    shutil.rmtree(output_static_diretory, ignore_errors=True)
     shutil.copytree(_STATIC_DIRECTORY, output_static_diretory)
-    _run_backup(client, output_directory, args.root_folder_id)
+    manifest = _Manifest(output_directory)
+    try:
+        _run_backup(client, output_directory, args.root_folder_id, manifest,
+            args.fetch_workers, args.blob_workers, args.write_workers,
+            args.queue_size)
+    finally:
+        manifest.save()
+
+def _run_backup(client, output_directory, root_folder_id, manifest,
+        fetch_workers=4, blob_workers=8, write_workers=2, queue_size=16):
+    blob_store = _BlobStore(client, manifest)
+    users = client.user_directory()
+    users.warm()
+    pipeline = _Pipeline([
+        (lambda job: _fetch_thread(job, client, users, manifest),
+         fetch_workers),
+        (lambda job: _download_images(job, blob_store), blob_workers),
+        (lambda job: _write_thread(job, client, users, manifest),
+         write_workers),
+    ], queue_size, finish=lambda job: _finish_thread(job, manifest))
+    pipeline.run(_discover_threads(
+        client, output_directory, root_folder_id, manifest))
 
-def _run_backup(client, output_directory, root_folder_id):
+def _discover_threads(client, output_directory, root_folder_id, manifest):
+    """Yields a `_ThreadJob` for each thread to back up: the documents in the
+    folders, and then the conversations."""
     user = client.get_authenticated_user()
-    processed_folder_ids = set()
     if root_folder_id:
-        _descend_into_folder(root_folder_id, processed_folder_ids,
-            client, output_directory, 0)
+        root_folder_ids = [root_folder_id]
     else:
-        _descend_into_folder(user["private_folder_id"], processed_folder_ids,
-            client, output_directory, 0)
-        _descend_into_folder(user["starred_folder_id"], processed_folder_ids,
-            client, output_directory, 0)
+        root_folder_ids = [user["private_folder_id"], user["starred_folder_id"]]
+    folder_output_paths = {}
+    for path, folder, threads in client.walk_folders(root_folder_ids):
+        depth = len(path) - 1
+        parent_output_path = folder_output_paths.get(
+            path[-2] if depth else None, output_directory)
+        title = folder["folder"].get("title", "Folder %s" % path[-1])
+        logging.info("%sBacking up folder %s...", "  " * depth, title)
+        folder_output_path = os.path.join(
+            parent_output_path, _sanitize_title(title))
+        _ensure_path_exists(folder_output_path)
+        folder_output_paths[path[-1]] = folder_output_path
+        for thread in threads:
+            yield _ThreadJob(thread, folder_output_path, depth + 1)
     logging.info("Looking for conversations")
-    conversation_threads = _get_conversation_threads(client)
+    # Threads are listed most recently updated first, so only the ones
+    # updated since the last backup need to be listed.
+    conversation_threads = _get_conversation_threads(
+        client, manifest.conversations_updated_usec)
     if conversation_threads:
         conversations_directory = os.path.join(output_directory, "Conversations")
         _ensure_path_exists(conversations_directory)
         for thread in conversation_threads:
-            _backup_thread(thread, client, conversations_directory, 1)
+            yield _ThreadJob(thread, conversations_directory, 1,
+                conversation=manifest.start_conversation(
+                    thread["thread"]["updated_usec"]))
 
-def _descend_into_folder(folder_id, processed_folder_ids, client,
-        output_directory, depth):
-    if folder_id in processed_folder_ids:
-        return
-    processed_folder_ids.add(folder_id)
-    try:
-        folder = client.get_folder(folder_id)
-    except quip.QuipError as e:
-        if e.code == 403:
-            logging.warning("%sSkipped over restricted folder %s.",
-                "  " * depth, folder_id)
-        else:
-            logging.warning("%sSkipped over folder %s due to unknown error %d.",
-                "  " * depth, folder_id, e.code)
-        return
-    except urllib2.HTTPError as e:
-        logging.warning("%sSkipped over folder %s due to HTTP error %d.",
-            "  " * depth, folder_id, e.code)
-        return
-    title = folder["folder"].get("title", "Folder %s" % folder_id)
-    logging.info("%sBacking up folder %s...", "  " * depth, title)
-    folder_output_path = os.path.join(output_directory, _sanitize_title(title))
-    _ensure_path_exists(folder_output_path)
-    for child in folder["children"]:
-        if "folder_id" in child:
-            _descend_into_folder(child["folder_id"], processed_folder_ids,
-                client, folder_output_path, depth + 1)
-        elif "thread_id" in child:
-            thread = client.get_thread(child["thread_id"])
-            _backup_thread(thread, client, folder_output_path, depth + 1)
-
-def _backup_thread(thread, client, output_directory, depth):
-    thread_id = thread["thread"]["id"]
-    title = thread["thread"]["title"]
+class _ThreadJob(object):
+    """A thread on its way through the steps of the backup."""
+    def __init__(self, thread, output_directory, depth, conversation=None):
+        self.thread = thread
+        self.thread_id = thread["thread"]["id"]
+        self.title = thread["thread"]["title"]
+        self.output_directory = output_directory
+        self.depth = depth
+        self.conversation = conversation
+        sanitized_title = _sanitize_title(self.title)
+        self.document_output_path = None
+        if "html" in thread:
+            self.document_output_path = os.path.join(
+                output_directory, sanitized_title + ".html")
+        title_suffix = "messages" if "html" in thread else self.thread_id
+        self.messages_output_path = os.path.join(
+            output_directory, "%s (%s).html" % (sanitized_title, title_suffix))
+        self.entry = None
+        self.tree = None
+        # The messages to write, and whether they are new ones to add to the
+        # messages already written.
+        self.messages = None
+        self.append = False
+
+def _fetch_thread(job, client, users, manifest):
+    """Skips the thread if it has not changed since the last backup, and
+    otherwise parses its document and fetches its messages."""
+    entry = manifest.get_thread(job.thread_id, job.output_directory)
+    if entry and manifest.moved(
+            entry, job.document_output_path, job.messages_output_path):
+        # The thread was renamed, or its files are missing.
+        manifest.remove_files(entry)
+        entry = None
+    if entry and entry["updated_usec"] == job.thread["thread"]["updated_usec"]:
+        logging.debug("%sSkipping unchanged thread %s (%s)",
+            "  " * job.depth, job.title, job.thread_id)
+        return None
     logging.info("%sBacking up thread %s (%s)...",
-        "  " * depth, title, thread_id)
-    sanitized_title = _sanitize_title(title)
-    if "html" in thread:
+        "  " * job.depth, job.title, job.thread_id)
+    job.entry = entry
+    if "html" in job.thread:
         # Parse the document
         try:
-            tree = client.parse_document_html(thread["html"])
+            job.tree = client.parse_document_html(job.thread["html"])
         except xml.etree.cElementTree.ParseError as e:
             logging.error(
                 "Error parsing thread %s (%s), skipping backup: %s" % (
-                    title, thread_id, e))
-            return
-
-        # Download each image and replace with the new URL
-        for img in tree.iter("img"):
-            src = img.get("src")
-            if not src.startswith("/blob"):
-                continue
-            _, _, thread_id, blob_id = src.split("/")
-            blob_response = client.get_blob(thread_id, blob_id)
-            content_disposition = blob_response.info().get(
-                "Content-Disposition")
-            if content_disposition:
-                image_filename = content_disposition.split('"')[-2]
-            else:
-                image_filename = "image.png"
-            image_output_path = os.path.join(output_directory, image_filename)
-            with open(image_output_path, "w") as image_file:
-                image_file.write(blob_response.read())
-            img.set("src", image_filename)
-        html = unicode(xml.etree.cElementTree.tostring(tree))
-        # Strip the <html> tags that were introduced in parse_document_html
-        html = html[6:-7]
-
-        document_file_name = sanitized_title + ".html"
-        document_output_path = os.path.join(
-            output_directory, document_file_name)
-        document_html = _DOCUMENT_TEMPLATE % {
-            "title": _escape(title),
-            "stylesheet_path": ("../" * depth) +
-                _OUTPUT_STATIC_DIRECTORY_NAME + "/main.css",
-            "body": html,
-        }
-        with open(document_output_path, "w") as document_file:
-            document_file.write(document_html.encode("utf-8"))
-    messages = _get_thread_messages(thread_id, client)
-    if messages:
-        title_suffix = "messages" if "html" in thread else thread_id
-        message_file_name = "%s (%s).html" % (sanitized_title, title_suffix)
-        messages_output_path = os.path.join(output_directory, message_file_name)
-        messages_html = _MESSAGES_TEMPLATE % {
-            "title": _escape(title),
-            "stylesheet_path": ("../" * depth) +
+                    job.title, job.thread_id, e))
+            return None
+    if entry and entry["last_message_usec"]:
+        job.messages = _stage_messages(client, users, job.thread_id,
+            job.output_directory, entry["last_message_usec"])
+        job.append = True
+    else:
+        job.messages = _stage_messages(
+            client, users, job.thread_id, job.output_directory)
+    return job
+
+def _download_images(job, blob_store):
+    """Makes sure the images of the thread's document are in the blob store,
+    and points the document at them."""
+    if job.tree is None:
+        return job
+    for img in job.tree.iter("img"):
+        src = img.get("src")
+        if not src.startswith("/blob"):
+            continue
+        _, _, thread_id, blob_id = src.split("/")
+        blob = blob_store.get(thread_id, blob_id)
+        img.set("src", ("../" * job.depth) + blob["path"])
+    return job
+
+def _write_thread(job, client, users, manifest):
+    """Writes the thread's document and messages, and records them in the
+    manifest."""
+    if job.tree is not None:
+        _write_document(job)
+    last_message_usec = None
+    try:
+        if job.append:
+            last_message_usec = job.entry["last_message_usec"]
+            if job.messages.last_message_usec:
+                if _append_messages(job.messages_output_path, job.messages):
+                    last_message_usec = job.messages.last_message_usec
+                else:
+                    # The file does not end as it was written; start over.
+                    job.messages.close()
+                    job.messages = _stage_messages(
+                        client, users, job.thread_id, job.output_directory)
+                    job.append = False
+        if not job.append and job.messages.last_message_usec:
+            _write_messages(job)
+            last_message_usec = job.messages.last_message_usec
+    finally:
+        job.messages.close()
+    manifest.put_thread(job.thread_id, job.output_directory, {
+        "updated_usec": job.thread["thread"]["updated_usec"],
+        "last_message_usec": last_message_usec,
+        "document_path": manifest.relative(job.document_output_path),
+        "messages_path": manifest.relative(job.messages_output_path),
+    })
+    return job
+
+def _finish_thread(job, manifest):
+    if job.conversation is not None:
+        manifest.finish_conversation(job.conversation)
+
+def _write_document(job):
+    html = unicode(xml.etree.cElementTree.tostring(job.tree))
+    # Strip the <html> tags that were introduced in parse_document_html
+    html = html[6:-7]
+
+    document_html = _DOCUMENT_TEMPLATE % {
+        "title": _escape(job.title),
+        "stylesheet_path": ("../" * job.depth) +
+            _OUTPUT_STATIC_DIRECTORY_NAME + "/main.css",
+        "body": html,
+    }
+    with open(job.document_output_path, "w") as document_file:
+        document_file.write(document_html.encode("utf-8"))
+
+def _write_messages(job):
+    head, tail = _MESSAGES_TEMPLATE.split("%(body)s")
+    with open(job.messages_output_path, "w") as messages_file:
+        messages_file.write((head % {
+            "title": _escape(job.title),
+            "stylesheet_path": ("../" * job.depth) +
                 _OUTPUT_STATIC_DIRECTORY_NAME + "/main.css",
-            "body": "".join([_MESSAGE_TEMPLATE % {
-                "author_name":
-                    _escape(_get_user(client, message["author_id"])["name"]),
-                "timestamp": _escape(_format_usec(message["created_usec"])),
-                "message_text": _escape(message["text"]),
-            } for message in messages])
-        }
-        with open(messages_output_path, "w") as messages_file:
-            messages_file.write(messages_html.encode("utf-8"))
-
-def _get_thread_messages(thread_id, client):
-    max_created_usec = None
-    messages = []
-    while True:
-        chunk = client.get_messages(
-            thread_id, max_created_usec=max_created_usec, count=100)
-        messages.extend(chunk)
-        if chunk:
-            max_created_usec = chunk[-1]["created_usec"] - 1
-        else:
-            break
-    messages.reverse()
-    return messages
-
-def _get_conversation_threads(client):
-    max_updated_usec = None
+        }).encode("utf-8"))
+        job.messages.copy_to(messages_file)
+        messages_file.write(tail.encode("utf-8"))
+
+def _append_messages(messages_output_path, messages):
+    """Adds the given messages to the end of a messages file, and returns
+    whether the file ended as expected."""
+    tail = _MESSAGES_TEMPLATE.split("%(body)s")[1].encode("utf-8")
+    with open(messages_output_path, "r+b") as messages_file:
+        # Insert the messages before the closing tags of the template.
+        messages_file.seek(-len(tail), os.SEEK_END)
+        if messages_file.read() != tail:
+            return False
+        messages_file.seek(-len(tail), os.SEEK_END)
+        messages.copy_to(messages_file)
+        messages_file.write(tail)
+        messages_file.truncate()
+    return True
+
+def _render_messages(users, messages):
+    authors = users.resolve(message["author_id"] for message in messages)
+    return "".join([_MESSAGE_TEMPLATE % {
+        "author_name": _escape(_author_name(authors, message["author_id"])),
+        "timestamp": _escape(_format_usec(message["created_usec"])),
+        "message_text": _escape(message["text"]),
+    } for message in messages]).encode("utf-8")
+
+def _stage_messages(client, users, thread_id, directory, since_usec=None):
+    """Renders the messages of the given thread sent after `since_usec`, or
+    all of them, into a `_StagedMessages` in `directory`."""
+    staged = _StagedMessages(directory)
+    messages = client.iter_messages(thread_id, count=_MESSAGE_PAGE_SIZE)
+    try:
+        page = []
+        for message in messages:
+            if since_usec and message["created_usec"] <= since_usec:
+                break
+            page.append(message)
+            if len(page) == _MESSAGE_PAGE_SIZE:
+                staged.add_page(users, page)
+                page = []
+        if page:
+            staged.add_page(users, page)
+    except BaseException:
+        staged.close()
+        raise
+    finally:
+        messages.close()
+    return staged
+
+class _StagedMessages(object):
+    """Rendered messages, staged in a temporary file.
+
+    Messages are listed newest first, but written oldest first. Each page is
+    rendered as it arrives and staged, and the pages are copied out in
+    reverse order, so that only one page is held in memory however long the
+    thread is.
+    """
+    def __init__(self, directory):
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._pages = []  # (offset, length) of each page, newest first
+        self.last_message_usec = None
+
+    def add_page(self, users, messages):
+        """Stages a page of messages, given newest first."""
+        if self.last_message_usec is None:
+            self.last_message_usec = messages[0]["created_usec"]
+        rendered = _render_messages(users, messages[::-1])
+        self._pages.append((self._file.tell(), len(rendered)))
+        self._file.write(rendered)
+
+    def copy_to(self, output_file):
+        """Writes the staged messages to `output_file`, oldest first."""
+        for offset, length in reversed(self._pages):
+            self._file.seek(offset)
+            output_file.write(self._file.read(length))
+
+    def close(self):
+        self._file.close()
+
+def _get_conversation_threads(client, since_usec=None):
     threads = []
-    thread_ids = set()
-    while True:
-        chunk = client.get_recent_threads(
-            max_updated_usec=max_updated_usec, count=50).values()
-        chunk.sort(key=lambda t:t["thread"]["updated_usec"], reverse=True)
-        threads.extend([t for t in chunk
-            if "html" not in t and t["thread"]["id"] not in thread_ids])
-        thread_ids.update([t["thread"]["id"] for t in chunk])
-        if chunk:
-            chunk_max_updated_usec = chunk[-1]["thread"]["updated_usec"] - 1
-            if chunk_max_updated_usec == max_updated_usec:
-                logging.warning("New chunk had the same max_updated_usec (%d) "
-                    "as the last one, can't get any older threads",
-                    max_updated_usec)
+    with contextlib.closing(client.iter_recent_threads()) as recent_threads:
+        for thread in recent_threads:
+            if since_usec and thread["thread"]["updated_usec"] <= since_usec:
                 break
-            max_updated_usec = chunk_max_updated_usec
-        else:
-            break
-        logging.info("  Got %d threads, paged back to %s",
-            len(threads), _format_usec(max_updated_usec))
+            if "html" not in thread:
+                threads.append(thread)
+    logging.info("  Got %d threads", len(threads))
     threads.reverse()
     return threads
 
+class _Pipeline(object):
+    """Passes jobs through a sequence of stages, each run by its own pool of
+    worker threads.
+
+    The stages are connected by bounded queues, so a slow stage holds back
+    the ones before it instead of letting jobs pile up in memory. Each stage
+    is a `(function, workers)` pair, where the function takes a job and
+    returns it for the next stage, or None to drop it. `finish` is called
+    with each job that leaves the pipeline, done or dropped.
+    """
+    _DONE = object()
+
+    def __init__(self, stages, queue_size, finish=None):
+        self.stages = stages
+        self.finish = finish
+        self._queues = [Queue.Queue(maxsize=queue_size) for _ in stages]
+        self._running = [workers for _, workers in stages]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+
+    def run(self, jobs):
+        """Runs the given jobs, which are produced on the calling thread,
+        through the pipeline, and returns once they are all done. If a stage
+        fails, the pipeline stops and the error is raised."""
+        threads = []
+        for stage, (_, workers) in enumerate(self.stages):
+            for _ in range(workers):
+                thread = threading.Thread(target=self._work, args=(stage,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        try:
+            for job in jobs:
+                if not self._put(0, job):
+                    break
+        except BaseException as e:
+            self._fail(e)
+        for _ in range(self.stages[0][1]):
+            self._put(0, self._DONE)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+        if self._error:
+            raise self._error
+
+    def _work(self, stage):
+        function = self.stages[stage][0]
+        last = stage == len(self.stages) - 1
+        try:
+            while True:
+                job = self._get(stage)
+                if job is None or job is self._DONE:
+                    break
+                result = function(job)
+                if result is None or last:
+                    if self.finish:
+                        self.finish(job)
+                elif not self._put(stage + 1, result):
+                    break
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            with self._lock:
+                self._running[stage] -= 1
+                done = not self._running[stage]
+            if done and not last:
+                for _ in range(self.stages[stage + 1][1]):
+                    self._put(stage + 1, self._DONE)
+
+    def _put(self, stage, job):
+        while not self._stop.is_set():
+            try:
+                self._queues[stage].put(job, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, stage):
+        while not self._stop.is_set():
+            try:
+                return self._queues[stage].get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        return None
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+class _BlobStore(object):
+    """Keeps a single copy of each image in the account, named after its blob
+    ID, for every document that uses it to point at.
+
+    An image is downloaded at most once per backup, even when several workers
+    ask for it at once, and not at all when the copy from an earlier backup
+    is still intact.
+    """
+    def __init__(self, client, manifest):
+        self.client = client
+        self.manifest = manifest
+        self.directory = os.path.join(
+            manifest.output_directory, _OUTPUT_BLOB_DIRECTORY_NAME)
+        _ensure_path_exists(self.directory)
+        self._lock = threading.Lock()
+        self._ready = set()
+        self._downloads = {}
+
+    def get(self, thread_id, blob_id):
+        """Returns the manifest entry of the given blob, with its path
+        relative to the output directory."""
+        with self._lock:
+            if blob_id in self._ready:
+                return self.manifest.get_blob(blob_id)
+            download = self._downloads.get(blob_id)
+            if download is None:
+                download = self._downloads[blob_id] = threading.Event()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            # Another worker is getting this blob; if it fails, try again.
+            download.wait()
+            return self.get(thread_id, blob_id)
+        try:
+            blob = self.manifest.get_blob(blob_id)
+            if not blob or not self._intact(blob):
+                blob = self._download(thread_id, blob_id)
+                self.manifest.put_blob(blob_id, blob)
+            with self._lock:
+                self._ready.add(blob_id)
+            return blob
+        finally:
+            with self._lock:
+                del self._downloads[blob_id]
+            download.set()
+
+    def _download(self, thread_id, blob_id):
+        name = re.sub(r"[^-\w]", "", blob_id)
+        # Stream the image to disk, then name it once we know its type.
+        download_path = os.path.join(self.directory, ".%s.download" % name)
+        blob_info = self.client.download_blob(
+            thread_id, blob_id, download_path)
+        content_disposition = blob_info.get("Content-Disposition")
+        extension = ".png"
+        if content_disposition:
+            extension = os.path.splitext(
+                content_disposition.split('"')[-2])[1] or extension
+        filename = name + _sanitize_title(extension)
+        image_output_path = os.path.join(self.directory, filename)
+        if os.path.exists(image_output_path):
+            os.remove(image_output_path)
+        os.rename(download_path, image_output_path)
+        return {
+            "sha1": _hash_file(image_output_path),
+            "path": "%s/%s" % (_OUTPUT_BLOB_DIRECTORY_NAME, filename),
+        }
+
+    def _intact(self, blob):
+        path = os.path.join(self.manifest.output_directory, blob["path"])
+        return os.path.exists(path) and _hash_file(path) == blob["sha1"]
+
+class _Manifest(object):
+    """Records what has been backed up to an output directory, so that an
+    incremental backup can skip what has not changed since.
+
+    For each thread, and each folder it is backed up to, the manifest keeps
+    the `updated_usec` it was backed up at, the `created_usec` of its last
+    message and the paths of its files. For each image in the blob store, it
+    keeps its SHA-1 hash and path.
+    """
+    def __init__(self, output_directory):
+        self.output_directory = output_directory
+        self.path = os.path.join(output_directory, _MANIFEST_FILE_NAME)
+        self.threads = {}
+        self.blobs = {}
+        self.conversations_updated_usec = None
+        self._conversations = []
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            self.threads = manifest["threads"]
+            self.blobs = manifest.get("blobs", {})
+            self.conversations_updated_usec = manifest[
+                "conversations_updated_usec"]
+
+    def get_thread(self, thread_id, output_directory):
+        return self.threads.get(thread_id, {}).get(
+            self.relative(output_directory))
+
+    def put_thread(self, thread_id, output_directory, entry):
+        with self._lock:
+            self.threads.setdefault(thread_id, {})[
+                self.relative(output_directory)] = entry
+
+    def get_blob(self, blob_id):
+        with self._lock:
+            return self.blobs.get(blob_id)
+
+    def put_blob(self, blob_id, blob):
+        with self._lock:
+            self.blobs[blob_id] = blob
+
+    def start_conversation(self, updated_usec):
+        """Notes that the conversation updated at `updated_usec` is being
+        backed up, and returns a token for `finish_conversation`.
+        Conversations must be started oldest first."""
+        with self._lock:
+            conversation = [updated_usec, False]
+            self._conversations.append(conversation)
+            return conversation
+
+    def finish_conversation(self, conversation):
+        """Notes that a conversation has been backed up. Once every older one
+        has been too, later backups need not list it again."""
+        with self._lock:
+            conversation[1] = True
+            while self._conversations and self._conversations[0][1]:
+                self.conversations_updated_usec = \
+                    self._conversations.pop(0)[0]
+
+    def remove_files(self, entry):
+        for path in (entry["document_path"], entry["messages_path"]):
+            if path and os.path.exists(
+                    os.path.join(self.output_directory, path)):
+                os.remove(os.path.join(self.output_directory, path))
+
+    def moved(self, entry, document_output_path, messages_output_path):
+        """Returns whether the files of the given thread entry are not where
+        they would be written now."""
+        for recorded, path in (
+                (entry["document_path"], document_output_path),
+                (entry["messages_path"], messages_output_path)):
+            if recorded != self.relative(path):
+                return True
+        if document_output_path and not os.path.exists(document_output_path):
+            return True
+        if entry["last_message_usec"] and not os.path.exists(
+                messages_output_path):
+            return True
+        return False
+
+    def relative(self, path):
+        if path is None:
+            return None
+        return os.path.relpath(path, self.output_directory)
+
+    def save(self):
+        temporary_path = self.path + ".tmp"
+        with self._lock:
+            with open(temporary_path, "w") as manifest_file:
+                json.dump({
+                    "threads": self.threads,
+                    "blobs": self.blobs,
+                    "conversations_updated_usec":
+                        self.conversations_updated_usec,
+                }, manifest_file)
+        os.rename(temporary_path, self.path)
+
+def _hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
 def _ensure_path_exists(directory_path):
     if os.path.exists(directory_path):
         return
@@ -244,14 +659,10 @@ def _sanitize_title(title):
         sanitized_title = sanitized_title[:_MAXIMUM_TITLE_LENGTH]
     return sanitized_title
 
-_user_cache = {}
-def _get_user(client, id):
-    if id not in _user_cache:
-        try:
-            _user_cache[id] = client.get_user(id)
-        except quip.QuipError:
-            _user_cache[id] = {"id": id, "name": "Unknown user %s" % id}
-    return _user_cache[id]
+def _author_name(authors, id):
+    if authors[id] is None:
+        return "Unknown user %s" % id
+    return authors[id]["name"]
 
 def _read_template(template_file_name):
     template_path = os.path.join(_TEMPLATE_DIRECTORY, template_file_name)
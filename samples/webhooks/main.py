@@ -31,7 +31,7 @@ JINJA_ENVIRONMENT = jinja2.Environment(
     extensions=["jinja2.ext.autoescape"],
     autoescape=True)
 
-_per_client_email_to_id_cache = {}
+_per_client_user_directory = {}
 
 class MainHandler(webapp2.RequestHandler):
     def get(self):
@@ -167,15 +167,14 @@ class HookHandler(webapp2.RequestHandler):
                 client.new_message(thread_id, message, silent=True)
 
     def _user_for_email(self, client, email):
-        cache = _per_client_email_to_id_cache.setdefault(
-            client.access_token, {})
-        if email not in cache:
-            try:
-                user = client.get_user(email)
-                cache[email] = "https://quip.com/%s" % user["id"]
-            except quip.QuipError:
-                cache[email] = None
-        return cache[email] or email
+        if client.access_token not in _per_client_user_directory:
+            _per_client_user_directory[client.access_token] = \
+                client.user_directory(max_entries=1000)
+        users = _per_client_user_directory[client.access_token]
+        user = users.get(email)
+        if user:
+            return "https://quip.com/%s" % user["id"]
+        return email
 
 
 